@@ -1,27 +1,51 @@
 import streamlit as st
-from openai import OpenAI
 import os
-import json
 import re
-from datetime import datetime
 import base64
-from search_api import search_results
+import time
+from stream_render import StreamRenderer, convert_latex
+import convo_store
+import image_store
+import context_builder
+import title_worker
+import gen_worker
+import hedging
+import tracing
 
 # 配置基础信息
-client = OpenAI(
-    base_url='https://api.siliconflow.cn/v1/',
-    api_key=os.getenv("SILICONFLOW_API_KEY")
-)
+# API客户端和搜索模块缓存为进程级单例，不随每次重跑重新创建；较重的依赖在首次使用时才导入
+@st.cache_resource(show_spinner=False)
+def get_client():
+    from openai import OpenAI
+    return OpenAI(
+        base_url=os.getenv("SILICONFLOW_BASE_URL", 'https://api.siliconflow.cn/v1/'),
+        api_key=os.getenv("SILICONFLOW_API_KEY")
+    )
+
+@st.cache_resource(show_spinner="正在加载搜索组件...")
+def get_search_api():
+    # 首次启用网络搜索时才导入 langchain/newspaper 等，并预先创建HTTP会话和搜索工具
+    import search_api
+    search_api.get_session()
+    search_api.get_search_tool()
+    return search_api
 
-HISTORY_DIR = "ChatHistory"
+# 可选的 Prometheus 指标端点，例如 METRICS_PORT=9464
+if os.getenv("METRICS_PORT"):
+    tracing.start_metrics_server(int(os.getenv("METRICS_PORT")))
+
+HISTORY_DIR = convo_store.HISTORY_DIR
 MEMORY_FILE = "memories.json"
 NUM_CONVO_DISPLAY = 10
+NUM_MSG_DISPLAY = 20
 os.makedirs(HISTORY_DIR, exist_ok=True)
 name_model = "deepseek-ai/DeepSeek-V3"
 #name_model = "THUDM/GLM-4-32B-0414"
 #vlm_model = "deepseek-ai/deepseek-vl2"
 vlm_model = "Qwen/Qwen2.5-VL-72B-Instruct"
 vlm_max_tokens = 4096
+TITLE_MAX_TOKENS = 32   # 标题不超过15字
+TITLE_TIMEOUT = 15      # 标题生成超时（秒）
 
 def init_session():
     if 'messages' not in st.session_state:
@@ -32,6 +56,32 @@ def init_session():
         st.session_state.convo_list = []
     if 'num_convo_display' not in st.session_state:
         st.session_state.num_convo_display = 10
+    # 已写入磁盘的消息数，保存时只追加之后的消息
+    if 'saved_count' not in st.session_state:
+        st.session_state.saved_count = 0
+    if 'image_max_edge' not in st.session_state:
+        st.session_state.image_max_edge = image_store.IMAGE_MAX_EDGE
+    if 'image_quality' not in st.session_state:
+        st.session_state.image_quality = image_store.IMAGE_QUALITY
+    # 每条消息的token统计缓存
+    if 'token_cache' not in st.session_state:
+        st.session_state.token_cache = {}
+    if 'num_msg_display' not in st.session_state:
+        st.session_state.num_msg_display = NUM_MSG_DISPLAY
+    if 'hedge_percentile' not in st.session_state:
+        st.session_state.hedge_percentile = round(hedging.HEDGE_PERCENTILE)
+    # 已显示完毕的后台生成任务，避免重跑时重复显示
+    if 'consumed_job' not in st.session_state:
+        st.session_state.consumed_job = None
+    # 上一轮的耗时追踪，用于调试面板
+    if 'last_trace' not in st.session_state:
+        st.session_state.last_trace = None
+    # 旧版JSON对话记录迁移（每个会话只检查一次）
+    if 'legacy_migrated' not in st.session_state:
+        migrated = convo_store.migrate_legacy()
+        if migrated:
+            print(f"已迁移 {migrated} 个旧版对话记录")
+        st.session_state.legacy_migrated = True
     # 新增模型参数初始化
     if 'selected_model' not in st.session_state:
         st.session_state.selected_model = "deepseek-ai/DeepSeek-R1"
@@ -49,8 +99,9 @@ def init_session():
                 if item["type"] == "image_url":
                     item["image_url"]["url"] = str(item["image_url"]["url"])
 
-def generate_filename(content):
-    # 提取文本内容用于生成文件名
+@tracing.traced("generate_title")
+def generate_title(content):
+    # 提取文本内容用于生成标题
     text_content = ""
     if isinstance(content, list):
         texts = [item["text"] for item in content if isinstance(item, dict) and item.get("type") == "text"]
@@ -58,22 +109,24 @@ def generate_filename(content):
     else:
         text_content = str(content)
 
-    response = client.chat.completions.create(
+    gen_worker.throttle()
+    response = get_client().chat.completions.create(
         model=name_model,
         messages=[
             {"role": "system", "content": "你是一个对话命名助手，帮助提取对话关键词作为对话记录文件名，十五字以内。"},
             {"role": "user", "content": "提取对话的主题（仅输出主题本身）：" + text_content}],
-        temperature=1.5,
-        max_tokens=1024
+        temperature=0.6,
+        max_tokens=TITLE_MAX_TOKENS,
+        timeout=TITLE_TIMEOUT
     )
     clean_content = response.choices[0].message.content.strip()
 
-    clean_content = re.sub(r'[\n\r\t\\/*?:"<>|]', "", clean_content)[:15]
-    timestamp = datetime.now().strftime("%m%d%H%M")
-    return f"{timestamp}_{clean_content}.json" if clean_content else f"{timestamp}_未命名.json"
+    return re.sub(r'[\n\r\t\\/*?:"<>|]', "", clean_content)[:15]
 
+@tracing.traced("generate_search_keyword")
 def generate_search_keyword(query):
-    response = client.chat.completions.create(
+    gen_worker.throttle()
+    response = get_client().chat.completions.create(
         model=name_model,
         messages=[
             {"role": "system", "content": "你是一个搜索关键词优化助手，请根据用户问题生成3个最相关的搜索关键词，用逗号分隔。"},
@@ -86,74 +139,113 @@ def generate_search_keyword(query):
     # return re.sub(r"[^a-zA-Z0-9\u4e00-\u9fa5,]", "", keywords)
     return keywords
 
-def convert_messages_for_api(messages, use_vlm):
-    """转换消息格式适配不同模型"""
-    converted = []
-    for msg in messages:
-        if use_vlm:
-            if isinstance(msg["content"], list):
-                content = []
-                for item in msg["content"]:
-                    if item["type"] in ["text", "image_url"]:  # 只保留这两种类型
-                        content_item = {"type": item["type"]}
-                        if item["type"] == "image_url":
-                            content_item["image_url"] = {"url": item["image_url"]["url"]}
-                        elif item["type"] == "text":
-                            content_item["text"] = item.get("text", "")
-                        content.append(content_item)
-            else:
-                content = [{"type": "text", "text": str(msg["content"])}]
-        else:
-            if isinstance(msg["content"], list):
-                ref_text = ""
-                content = ""
-                for item in msg["content"]:
-                    if item.get("type") == "reference":
-                        ref_text = "\n\n【相关参考资料】\n"
-                        for i,ref in enumerate(item.get("reference",[])):
-                            ref_text += f"{i + 1}. {ref.get('content','')[:4096]}\n\n来源：{ref.get('title','无标题')} ({ref.get('link','无链接')})\n\n"
-                if ref_text:
-                    content = ref_text +"原输入：\n"
-                text_parts = [item["text"] for item in msg["content"] if item.get("type") == "text"]
-                content += " ".join(text_parts)
-            else:
-                content = msg["content"]
-        converted.append({"role": msg["role"], "content": content})
-    return converted
+def convert_messages_for_api(messages, use_vlm, model, max_tokens):
+    """转换消息格式适配不同模型，并按模型的上下文预算裁剪历史，返回 (消息列表, 用量报告)"""
+    budget = context_builder.context_budget(model, max_tokens)
+    return context_builder.build_context(messages, use_vlm, budget, st.session_state.token_cache)
 
 def refresh_convo_list():
-    st.session_state.convo_list = [
-        f for f in os.listdir(HISTORY_DIR)
-        if f.endswith('.json') and os.path.getsize(os.path.join(HISTORY_DIR, f)) > 0
-    ]
-    st.session_state.convo_list.reverse()
+    # 只查询当前需要显示的一页，按最近更新时间排序
+    st.session_state.convo_list = convo_store.list_conversations(st.session_state.num_convo_display)
+    st.session_state.convo_total = convo_store.count_conversations()
 
 
 def new_conversation():
     st.session_state.messages = []
     st.session_state.current_convo = None
-
-
-def load_conversation(filename):
-    path = os.path.join(HISTORY_DIR, filename)
-    with open(path, 'r', encoding='utf-8') as f:
-        st.session_state.messages = json.load(f)
-    st.session_state.current_convo = filename
-
-def save_conversation():
+    st.session_state.saved_count = 0
+    st.session_state.num_msg_display = NUM_MSG_DISPLAY
+    st.session_state.token_cache = {}
+
+
+def load_conversation(name):
+    st.session_state.messages = convo_store.load_messages(name)
+    st.session_state.current_convo = name
+    st.session_state.saved_count = len(st.session_state.messages)
+    # 已结束的生成任务的回答已在记录中，不再单独显示
+    job = gen_worker.get(name)
+    st.session_state.consumed_job = job.id if job and job.done else None
+    st.session_state.num_msg_display = NUM_MSG_DISPLAY
+    st.session_state.token_cache = {}
+
+@tracing.traced("save_conversation")
+def save_conversation(title=None):
     if st.session_state.current_convo and st.session_state.messages:
-        path = os.path.join(HISTORY_DIR, st.session_state.current_convo)
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(st.session_state.messages, f, ensure_ascii=False, indent=2)
+        # 只追加尚未保存的消息
+        convo_store.append_messages(st.session_state.current_convo,
+                                    st.session_state.messages[st.session_state.saved_count:], title)
+        st.session_state.saved_count = len(st.session_state.messages)
 
 
 def render_with_latex(text: str):
-    text = text.replace(r'\\\\',r"\\")
-    text = text.replace(r'\(',r"$")
-    text = text.replace(r'\)', r"$")
-    text = text.replace(r'\[', r"$$")
-    text = text.replace(r'\]', r"$$")
-    st.markdown(text)
+    st.markdown(convert_latex(text))
+
+
+def render_generation(job):
+    """显示后台任务生成的回答：先回放已生成的部分，再跟随新内容直到生成结束"""
+    with st.chat_message("assistant", avatar="🤖"):
+        status_placeholder = st.empty()
+        reasoning_placeholder = st.empty()
+        answer_placeholder = st.empty()
+        stop_placeholder = st.empty()
+        if not job.done and stop_placeholder.button("⏹ 停止生成", key=f"stop_{job.id}"):
+            job.cancel()
+        reasoning_renderer = None
+        answer_renderer = StreamRenderer(answer_placeholder.container())
+        full_reasoning = ""
+        offset = 0
+        queued = False
+
+        with tracing.span("render_stream", replayed=len(job.events)) as render_span:
+            render_seconds = 0.0
+            while True:
+                events = job.read(offset)
+                # 排队时显示前面的请求数
+                if job.status == gen_worker.QUEUED:
+                    status_placeholder.caption(f"⏳ 排队中，前面还有 {gen_worker.queue_position(job)} 个请求")
+                    queued = True
+                elif queued:
+                    status_placeholder.empty()
+                    queued = False
+                render_start = time.perf_counter()
+                for kind, text in events:
+                    if kind == "answer":
+                        answer_renderer.feed(text)
+                        continue
+                    # 处理推理过程
+                    full_reasoning += text
+                    if reasoning_renderer is None and full_reasoning.strip():
+                        reasoning_renderer = StreamRenderer(reasoning_placeholder.expander("🤔 实时推理"))
+                    if reasoning_renderer is not None:
+                        reasoning_renderer.feed(text)
+                render_seconds += time.perf_counter() - render_start
+                offset += len(events)
+                if job.done and offset >= len(job.events):
+                    break
+            render_span["render_s"] = render_seconds
+
+        # 显示最终响应
+        status_placeholder.empty()
+        stop_placeholder.empty()
+        with reasoning_placeholder:
+            if full_reasoning.strip():
+                with st.expander("🧠 推理过程"):
+                    render_with_latex(full_reasoning.strip())
+        answer_renderer.finish()
+        if job.status == gen_worker.ERROR:
+            st.error(f"请求失败: {job.error}")
+        elif job.status == gen_worker.CANCELLED:
+            st.caption("⏹ 已停止生成")
+        if job.route in ("hedge", "failover"):
+            st.caption(f"⚡ 由 {job.served_model} 响应（{'对冲' if job.route == 'hedge' else '故障转移'}）")
+        if job.message.get("context"):
+            st.caption("📊 " + context_builder.format_report(job.message["context"]))
+
+    # 回答已由后台任务保存，这里只同步到会话
+    if len(st.session_state.messages) < convo_store.count_messages(job.key):
+        st.session_state.messages.append(job.message)
+    st.session_state.saved_count = len(st.session_state.messages)
+    st.session_state.consumed_job = job.id
 
 # 初始化会话
 init_session()
@@ -171,6 +263,22 @@ with st.sidebar:
         help="启用网络搜索增强回答准确性"
     )
 
+    st.session_state.enable_hedging = st.checkbox(
+        "对冲请求 (hedging)",
+        value=st.session_state.get("enable_hedging", False),
+        help="首token迟迟未到时，向配对的端点（如 DeepSeek-R1 与 Pro/DeepSeek-R1）发出同一请求，"
+             "采用先响应的一方；会额外消耗少量请求额度。请求失败（5xx/超时）时总会自动切换端点"
+    )
+    if st.session_state.enable_hedging:
+        st.session_state.hedge_percentile = st.select_slider(
+            "对冲延迟",
+            # 环境变量 HEDGE_PERCENTILE 可能不在预设选项中，一并列出
+            options=sorted({50, 75, 90, 95, 99, st.session_state.hedge_percentile}),
+            value=st.session_state.hedge_percentile,
+            format_func=lambda p: f"p{p} 首token延迟",
+            help="等待时间取该模型近期首token延迟的分位数，越小对冲越积极"
+        )
+
     st.session_state.selected_model = st.selectbox(
         "选择对话模型",
         ["deepseek-ai/DeepSeek-R1",
@@ -236,27 +344,71 @@ with st.sidebar:
             format="%.2f"
         )
 
+    with st.expander("图片预处理"):
+        st.session_state.image_max_edge = st.select_slider(
+            "最大边长",
+            options=[0, 768, 1024, 1536, 2048, 3072],
+            value=st.session_state.image_max_edge,
+            format_func=lambda edge: "原图" if edge == 0 else f"{edge}px",
+            help="上传图片超过该尺寸时等比缩小后再发送给视觉模型"
+        )
+        st.session_state.image_quality = st.slider(
+            "JPEG质量",
+            50, 95, st.session_state.image_quality, 5,
+            help="重新编码的质量，越低体积越小"
+        )
+
+    with st.expander("🐞 调试：上一轮耗时"):
+        last_trace = st.session_state.last_trace
+        if last_trace:
+            st.code(tracing.waterfall(last_trace), language=None)
+            attrs = {}
+            for entry in last_trace["spans"]:
+                if entry["name"] in ("chat_completion", "render_stream"):
+                    attrs.update(entry["attrs"])
+            if attrs.get("ttft") is not None:
+                st.caption(f"首token {attrs['ttft']:.2f}s · 推理 {attrs['reasoning_tokens']} / "
+                           f"回答 {attrs['answer_tokens']} tokens · {attrs['tokens_per_s']:.1f} tokens/s · "
+                           f"渲染 {attrs.get('render_s', 0.0):.2f}s")
+            st.caption(f"日志: {tracing.TRACE_FILE}")
+        else:
+            st.caption("尚无记录")
+
     if st.button("➕ 新建对话", use_container_width=True):
-        st.session_state.messages = []
-        st.session_state.current_convo = None
+        new_conversation()
         st.rerun()
 
     st.subheader("历史对话")
+    search_query = st.text_input("🔍 搜索历史对话", key="convo_search", placeholder="输入关键词，空格分隔")
+    if search_query.strip():
+        hits = convo_store.search(search_query)
+        if not hits:
+            st.caption("没有找到相关对话")
+        for hit in hits:
+            if st.button(hit['title'], key=f"hit_{hit['name']}", use_container_width=True):
+                load_conversation(hit['name'])
+                st.rerun()
+            st.caption(hit['snippet'])
+        st.divider()
+
     refresh_convo_list()
     convo_render_list = st.session_state.convo_list[:st.session_state.num_convo_display]
-    for convo in convo_render_list:
+    for item in convo_render_list:
+        convo = item['name']
         cols = st.columns([3, 1])
         with cols[0]:
-            if st.button(convo[:-5], key=f"btn_{convo}", use_container_width=True):
+            if st.button(item['title'], key=f"btn_{convo}", use_container_width=True):
                 load_conversation(convo)
                 st.rerun()
         with cols[1]:
             if st.button("×", key=f"del_{convo}", type='primary'):
-                os.remove(os.path.join(HISTORY_DIR, convo))
+                # 先取消后台生成，否则生成结束时保存回答会重新创建这个对话
+                gen_worker.discard(convo)
+                convo_store.delete(convo)
                 if st.session_state.current_convo == convo:
                     new_conversation()
                 st.rerun()
-    if st.session_state.num_convo_display < len(st.session_state.convo_list):
+    if st.session_state.num_convo_display < st.session_state.convo_total:
         if st.button("加载更多...",key="load_more_convo"):
             st.session_state.num_convo_display += 10
             st.rerun()
@@ -264,8 +416,13 @@ with st.sidebar:
 # 主界面布局
 st.title("智能对话助手（支持图文）")
 
-# 显示聊天记录（支持多模态）
-for msg in st.session_state.messages:
+# 显示聊天记录（支持多模态），长对话只渲染最近的消息
+hidden_count = max(0, len(st.session_state.messages) - st.session_state.num_msg_display)
+if hidden_count:
+    if st.button(f"显示更早的消息（还有 {hidden_count} 条）", key="load_more_msg"):
+        st.session_state.num_msg_display += NUM_MSG_DISPLAY
+        st.rerun()
+for msg in st.session_state.messages[hidden_count:]:
     avatar = "🧑" if msg["role"] == "user" else "🤖"
     with st.chat_message(msg["role"], avatar=avatar):
         # 先显示推理内容（如果有）
@@ -276,7 +433,13 @@ for msg in st.session_state.messages:
         # 再显示消息内容
         if isinstance(msg["content"], list):
             for item in msg["content"]:
-                if item["type"] == "image_url":
+                if item["type"] == "image":
+                    try:
+                        st.image(image_store.image_path(item["image_id"]), use_container_width=True)
+                    except:
+                        st.error("图片加载失败")
+                elif item["type"] == "image_url":
+                    # 兼容旧版内嵌base64的图片
                     try:
                         base64_str = item["image_url"]["url"].split(",")[1]
                         st.image(base64.b64decode(base64_str), use_container_width=True)
@@ -293,6 +456,8 @@ for msg in st.session_state.messages:
                                 st.caption(f"{ref['title']}\n{ref['link']}")
         else:
             render_with_latex(msg["content"])
+        if msg.get("context"):
+            st.caption("📊 " + context_builder.format_report(msg["context"]))
 
 # 处理用户输入（新增图片上传）
 uploaded_files = st.file_uploader(
@@ -302,22 +467,38 @@ uploaded_files = st.file_uploader(
     key="file_uploader"
 )
 
-if prompt := st.chat_input("请输入您的问题或描述..."):
+# 预处理上传的图片（按哈希缓存），并显示压缩效果
+prepared_images = []
+for uploaded_file in uploaded_files or []:
+    image_id, original_size, prepared_size = image_store.prepare_image(
+        uploaded_file.getvalue(), uploaded_file.type,
+        st.session_state.image_max_edge, st.session_state.image_quality
+    )
+    prepared_images.append(image_id)
+    # 空文件没有压缩比可言
+    change = f"（{prepared_size / original_size - 1:+.0%}）" if original_size else ""
+    st.caption(f"{uploaded_file.name}: {image_store.format_size(original_size)} → "
+               f"{image_store.format_size(prepared_size)}{change}")
+
+# 当前对话在后台生成中的回答：重跑、切换对话或刷新页面后重新接上
+active_job = gen_worker.get(st.session_state.current_convo)
+if active_job and active_job.id == st.session_state.consumed_job:
+    active_job = None
+generating = active_job is not None and not active_job.done
+trace = None
+
+if prompt := st.chat_input("请输入您的问题或描述...", disabled=generating):
+    trace = tracing.start_turn(model=st.session_state.selected_model,
+                               web_search=st.session_state.enable_web_search)
     # 构建多模态消息内容
     message_content = []
 
     # 处理上传的图片
-    for uploaded_file in uploaded_files:
-        if uploaded_file:
-            base64_str = base64.b64encode(uploaded_file.read()).decode("utf-8")
-            mime_type = uploaded_file.type
-            message_content.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:{mime_type};base64,{base64_str}"
-                }
-            })
-            uploaded_file.seek(0)  # 重置文件指针
+    for image_id in prepared_images:
+        message_content.append({
+            "type": "image",
+            "image_id": image_id
+        })
 
     # 处理文本输入
     if prompt.strip():
@@ -330,10 +511,13 @@ if prompt := st.chat_input("请输入您的问题或描述..."):
 
     # WEB_SEARCH 搜索
     if st.session_state.enable_web_search and not len(message_content) > 1:
-        print("正在进行网络搜索...")
         try:
-            key_words = generate_search_keyword(prompt.strip())
-            references = search_results(key_words)
+            with st.status("🔍 正在进行网络搜索...", expanded=False) as search_status, \
+                    tracing.span("web_search") as search_span:
+                references = get_search_api().orchestrate_search(prompt.strip(), generate_search_keyword,
+                                                progress=search_status.write)
+                search_span["references"] = len(references)
+                search_status.update(label=f"🔍 网络搜索完成，共 {len(references)} 条参考资料", state="complete")
             message_content.append({
                 "type": "reference",
                 "reference": references
@@ -351,10 +535,9 @@ if prompt := st.chat_input("请输入您的问题或描述..."):
     # 显示用户消息
     with st.chat_message("user", avatar="🧑"):
         for item in message_content:
-            if item["type"] == "image_url":
+            if item["type"] == "image":
                 try:
-                    base64_str = item["image_url"]["url"].split(",")[1]
-                    st.image(base64.b64decode(base64_str), use_container_width=True)
+                    st.image(image_store.image_path(item["image_id"]), use_container_width=True)
                 except:
                     st.error("图片显示失败")
             elif item["type"] == "text":
@@ -371,81 +554,48 @@ if prompt := st.chat_input("请输入您的问题或描述..."):
     # 自动选择模型
     use_vlm = any(
         isinstance(msg.get("content"), list) and
-        any(item.get("type") == "image_url" for item in msg.get("content", []))
+        any(item.get("type") in ("image", "image_url") for item in msg.get("content", []))
         for msg in st.session_state.messages[-1:]
     )
+    model = vlm_model if use_vlm else st.session_state.selected_model
+    max_tokens = vlm_max_tokens if use_vlm else st.session_state.max_tokens
+
+    # 先保存提问（新对话以临时名称保存，标题在后台生成），回答由后台任务生成并保存
+    filename_content = prompt.strip()
+    if not st.session_state.current_convo:
+        st.session_state.current_convo = convo_store.new_name()
+        save_conversation(convo_store.provisional_title(filename_content))
+        title_worker.submit(st.session_state.current_convo, filename_content, generate_title)
+    else:
+        save_conversation()
 
     # 准备API请求
     try:
-        with ((st.chat_message("assistant", avatar="🤖"))):
-            reasoning_placeholder = st.empty()
-            answer_placeholder = st.empty()
-            full_reasoning = ""
-            full_answer = ""
-
-            # 转换消息格式
-            api_messages = convert_messages_for_api(st.session_state.messages, use_vlm)
-
-            # 创建API请求
-            print("正在发送api请求...")
-            stream = client.chat.completions.create(
-                model=vlm_model if use_vlm else st.session_state.selected_model,
-                messages=api_messages,
-                stream=True,
-                max_tokens=vlm_max_tokens if use_vlm else st.session_state.max_tokens,
-                temperature=st.session_state.temperature,
-                top_p=st.session_state.top_p
-#                top_k=st.session_state.top_k
-            )
-
-            # 处理流式响应
-            for chunk in stream:
-                # 处理常规回答
-                if chunk.choices[0].delta.content:
-                    full_answer += chunk.choices[0].delta.content or ""
-                    with answer_placeholder:
-                        render_with_latex(full_answer + "▌")
-
-                # 处理推理过程
-                if hasattr(chunk.choices[0].delta, 'reasoning_content'):
-                    reasoning = chunk.choices[0].delta.reasoning_content or ""
-                    full_reasoning += reasoning
-                    if full_reasoning.strip():
-                        with reasoning_placeholder.expander("🤔 实时推理"):
-                            render_with_latex(full_reasoning)
-            print("响应接受完成。")
-
-            # 保存最终响应
-            with reasoning_placeholder:
-                if full_reasoning.strip():
-                    with st.expander("🧠 推理过程"):
-                        render_with_latex(full_reasoning.strip())
-            with answer_placeholder:
-                render_with_latex(full_answer)
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": full_answer,
-                "reasoning": full_reasoning.strip()
-            })
-
+        # 转换消息格式（按上下文预算裁剪）
+        with tracing.span("build_context") as context_span:
+            api_messages, context_report = convert_messages_for_api(
+                st.session_state.messages, use_vlm, model, max_tokens)
+            context_span["messages"] = len(api_messages)
+
+        active_job = gen_worker.start(st.session_state.current_convo, get_client(), {
+            "model": model,
+            "messages": api_messages,
+            "max_tokens": max_tokens,
+            "temperature": st.session_state.temperature,
+            "top_p": st.session_state.top_p
+#            "top_k": st.session_state.top_k
+        }, context_report, st.session_state.hedge_percentile if st.session_state.enable_hedging else None)
     except Exception as e:
         st.error(f"请求失败: {str(e)}")
-        st.session_state.messages.append({
-            "role": "assistant",
-            "content": "响应生成失败",
-            "reasoning": f"错误信息: {str(e)}"
-        })
 
-    # 生成文件名（优先使用文本内容）
-    filename_content = prompt.strip()
-    if not st.session_state.current_convo:
-        print("正在生成对话文件名...")
-        st.session_state.current_convo = generate_filename(filename_content)
-    # 保存对话记录
-    if st.session_state.current_convo:
-        save_conversation()
-        refresh_convo_list()
-    print("\n")
+if active_job:
+    render_generation(active_job)
+if trace:
+    refresh_convo_list()
+    st.session_state.last_trace = tracing.finish_turn(trace)
+elif generating:
+    # 回放结束后重跑一次，重新启用输入框
+    st.rerun()
 
 # 自动滚动和保存功能（保持不变）
 st.markdown("""
@@ -0,0 +1,111 @@
+"""对比正文提取的两种路径：重复下载（旧） vs 复用已下载的html（新）
+
+用法：
+    python bench/bench_extract.py record URL [URL ...]   # 录制页面到fixtures
+    python bench/bench_extract.py run                    # 在本地服务器上对比耗时与流量
+"""
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from newspaper import Article
+
+import page_cache
+from search_api import HEADERS, extract_content, fetch_webpage
+from fixture_server import FixtureServer
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "pages")
+INDEX_FILE = os.path.join(PAGES_DIR, "index.json")
+
+
+def load_index():
+    if not os.path.exists(INDEX_FILE):
+        return {}
+    with open(INDEX_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def record(urls):
+    """下载页面并保存为fixture"""
+    os.makedirs(PAGES_DIR, exist_ok=True)
+    index = load_index()
+    for url in urls:
+        response = requests.get(url, headers=HEADERS, timeout=15)
+        response.raise_for_status()
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12] + ".html"
+        with open(os.path.join(PAGES_DIR, name), 'w', encoding='utf-8') as f:
+            f.write(response.text)
+        index[name] = url
+        print(f"已录制 {url} -> {name}")
+    with open(INDEX_FILE, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+
+
+def extract_twice(url):
+    """旧路径：fetch_webpage之后newspaper再下载一次"""
+    html = fetch_webpage(url)
+    if not html:
+        return None
+    article = Article(url)
+    article.download()
+    article.parse()
+    return article.text
+
+
+def extract_once(url):
+    """新路径：直接解析已下载的html"""
+    html = fetch_webpage(url)
+    if not html:
+        return None
+    return extract_content(html, url)
+
+
+def measure(server, urls, func, clear_cache=True):
+    if clear_cache:
+        page_cache.clear()
+    server.reset_stats()
+    start = time.perf_counter()
+    extracted = sum(1 for url in urls if func(url))
+    elapsed = time.perf_counter() - start
+    return {
+        'pages': extracted,
+        'seconds': elapsed,
+        'requests': server.stats['requests'],
+        'bytes': server.stats['bytes'],
+    }
+
+
+def run():
+    names = sorted(f for f in os.listdir(PAGES_DIR) if f.endswith('.html'))
+    if not names:
+        print("没有可用的fixture页面，请先执行 record")
+        return
+    # 使用临时缓存目录，避免污染本地缓存
+    page_cache.CACHE_DIR = tempfile.mkdtemp()
+    page_cache.CACHE_FILE = os.path.join(page_cache.CACHE_DIR, "pages.db")
+    with FixtureServer(PAGES_DIR) as server:
+        urls = [f"{server.base_url}/{name}" for name in names]
+        old = measure(server, urls, extract_twice)
+        new = measure(server, urls, extract_once)
+        cached = measure(server, urls, extract_once, clear_cache=False)
+
+    print(f"{'路径':<10}{'页面':>6}{'请求数':>8}{'字节':>12}{'耗时(s)':>10}")
+    for label, r in (("重复下载", old), ("单次下载", new), ("缓存命中", cached)):
+        print(f"{label:<10}{r['pages']:>6}{r['requests']:>8}{r['bytes']:>12}{r['seconds']:>10.3f}")
+    print(f"\n节省流量: {old['bytes'] - new['bytes']} 字节 "
+          f"({(old['bytes'] - new['bytes']) / max(old['bytes'], 1):.0%})")
+    print(f"节省耗时: {old['seconds'] - new['seconds']:.3f} s")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "record":
+        record(sys.argv[2:])
+    else:
+        run()
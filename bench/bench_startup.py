@@ -0,0 +1,78 @@
+"""GUI.py 启动与重跑耗时基准
+
+每轮在新的子进程中用 streamlit AppTest 运行 GUI.py：
+- 冷启动：首次运行脚本的耗时（包括导入依赖）
+- 重跑：之后每次交互（切换侧边栏选项）触发的整脚本重跑耗时
+并列出首次运行后已被加载的重量级依赖。
+
+用法：
+    python bench/bench_startup.py                   # 测量当前的 GUI.py
+    python bench/bench_startup.py --root ../old     # 测量另一份检出（用于对比）
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+HEAVY_MODULES = ["openai", "langchain_community", "newspaper", "pypdf", "lxml", "PIL"]
+
+CHILD = r"""
+import json, sys, time
+sys.path.insert(0, {root!r})
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file({script!r}, default_timeout=120)
+start = time.perf_counter()
+app.run()
+cold = time.perf_counter() - start
+loaded = [name for name in {heavy!r} if name in sys.modules]
+reruns = []
+for i in range({reruns}):
+    start = time.perf_counter()
+    app.sidebar.checkbox[0].set_value(i % 2 == 0).run()
+    reruns.append(time.perf_counter() - start)
+print(json.dumps({{"cold": cold, "reruns": reruns, "loaded": loaded, "exception": bool(app.exception)}}))
+"""
+
+
+def run_once(root, reruns):
+    # 在临时目录中运行，避免读写真实的对话记录
+    work_dir = tempfile.mkdtemp(prefix="deepseek_gui_startup_")
+    try:
+        code = CHILD.format(root=root, script=os.path.join(root, "GUI.py"),
+                            heavy=HEAVY_MODULES, reruns=reruns)
+        env = dict(os.environ, SILICONFLOW_API_KEY=os.getenv("SILICONFLOW_API_KEY", "bench"))
+        output = subprocess.run([sys.executable, "-c", code], cwd=work_dir, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        return json.loads(output.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GUI.py 启动与重跑耗时基准")
+    parser.add_argument("--root", default=ROOT_DIR, help="包含 GUI.py 的目录")
+    parser.add_argument("--runs", type=int, default=3, help="冷启动次数（每次一个新进程）")
+    parser.add_argument("--reruns", type=int, default=10, help="每次冷启动后的重跑次数")
+    args = parser.parse_args()
+
+    root = os.path.abspath(args.root)
+    results = [run_once(root, args.reruns) for _ in range(args.runs)]
+    if any(result["exception"] for result in results):
+        print("⚠️ GUI.py 运行时出现异常")
+    cold = [result["cold"] for result in results]
+    reruns = [t for result in results for t in result["reruns"]]
+    print(f"测量对象: {os.path.join(root, 'GUI.py')}")
+    print(f"冷启动: 中位数 {statistics.median(cold) * 1000:.0f}ms（{len(cold)} 次）")
+    print(f"重跑:   中位数 {statistics.median(reruns) * 1000:.1f}ms，"
+          f"p90 {sorted(reruns)[int(len(reruns) * 0.9) - 1] * 1000:.1f}ms（{len(reruns)} 次）")
+    print(f"首次运行后已加载: {', '.join(results[0]['loaded']) or '无'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""本地的 OpenAI 兼容服务（/v1/chat/completions），用于离线基准测试
+
+流式请求先等待 ttft 秒（可按模型单独设置 model_ttft），再按 token_rate 逐个发送
+reasoning_content 和 content 增量；failing_models 中的模型返回 503，用于测试故障转移。
+非流式请求（关键词、标题）直接返回固定文本。
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REASONING_TEXT = "用户问的是强化学习中的策略梯度。先回忆定义 \\(\\nabla J(\\theta)\\)，再给出推导步骤。"
+ANSWER_TEXT = (
+    "策略梯度方法直接对策略参数求导。\n\n"
+    "目标函数为 \\[J(\\theta) = \\mathbb{E}_{\\tau}[R(\\tau)]\\]，其梯度可以写成期望形式。\n\n"
+    "```python\nloss = -(log_prob * advantage).mean()\n```\n\n"
+    "常见算法包括 **REINFORCE**、**A2C** 和 **PPO**，其中 PPO 通过裁剪比率 \\(r_t(\\theta)\\) 稳定训练。\n\n"
+)
+
+
+def tokens_of(text, count):
+    """把示例文本循环切成 count 个小片段，模拟逐 token 输出"""
+    pieces = []
+    while len(pieces) < count:
+        for i in range(0, len(text), 3):
+            pieces.append(text[i:i + 3])
+            if len(pieces) == count:
+                break
+    return pieces
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        config = self.server.config
+        if not body.get('stream'):
+            self._send_json({
+                "id": "bench", "object": "chat.completion", "created": int(time.time()), "model": body['model'],
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": config['completion_text']}}],
+            })
+            return
+
+        received = time.perf_counter()
+        if body['model'] in config['failing_models']:
+            self.send_error(503, "Service Unavailable")
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        time.sleep(config['model_ttft'].get(body['model'], config['ttft']))
+        interval = 1 / config['token_rate'] if config['token_rate'] else 0
+        deltas = [{"reasoning_content": t, "content": None} for t in tokens_of(REASONING_TEXT, config['reasoning_tokens'])]
+        deltas += [{"content": t} for t in tokens_of(ANSWER_TEXT, config['answer_tokens'])]
+        try:
+            for delta in deltas:
+                chunk = {"id": "bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": body['model'], "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+                if interval:
+                    time.sleep(interval)
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前断开（如停止生成）
+            return
+        with self.server.stats_lock:
+            self.server.stats['streams'] += 1
+            self.server.stats['stream_seconds'] += time.perf_counter() - received
+
+    def _send_json(self, data):
+        payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class FakeOpenAIServer:
+    """在后台线程中运行的假模型服务"""
+
+    def __init__(self, ttft=0.3, token_rate=200, reasoning_tokens=100, answer_tokens=300,
+                 completion_text="策略梯度, PPO 算法, 强化学习", model_ttft=None, failing_models=()):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), FakeOpenAIHandler)
+        self.httpd.config = {
+            'ttft': ttft,
+            'token_rate': token_rate,
+            'reasoning_tokens': reasoning_tokens,
+            'answer_tokens': answer_tokens,
+            'completion_text': completion_text,
+            'model_ttft': model_ttft or {},
+            'failing_models': set(failing_models),
+        }
+        self.httpd.stats = {'streams': 0, 'stream_seconds': 0.0}
+        self.httpd.stats_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,19 @@
+"""替代 DuckDuckGo 搜索工具的假搜索后端，返回指向本地 fixture 服务器的结果"""
+
+
+class FakeSearch:
+    def __init__(self, base_url, pages):
+        self.base_url = base_url
+        self.pages = pages
+
+    def invoke(self, query):
+        return [
+            {'snippet': f"{query} 相关内容", 'title': f"{query} - {name}", 'link': f"{self.base_url}/{name}"}
+            for name in self.pages
+        ]
+
+
+def install(search_api, base_url, pages):
+    """把 search_api 中的搜索后端替换为假后端"""
+    tool = FakeSearch(base_url, pages)
+    search_api.get_search_tool = lambda: tool
@@ -0,0 +1,49 @@
+"""本地静态文件服务器，用于离线基准测试（统计请求数与传输字节数）"""
+import functools
+import os
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+
+class CountingHandler(SimpleHTTPRequestHandler):
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'content-length':
+            with self.server.stats_lock:
+                self.server.stats['requests'] += 1
+                self.server.stats['bytes'] += int(value)
+        super().send_header(keyword, value)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer:
+    """在后台线程中运行的本地HTTP服务器"""
+
+    def __init__(self, directory, handler=CountingHandler):
+        handler = functools.partial(handler, directory=os.fspath(directory))
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.httpd.stats = {'requests': 0, 'bytes': 0}
+        self.httpd.stats_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def stats(self):
+        return self.httpd.stats
+
+    def reset_stats(self):
+        with self.httpd.stats_lock:
+            self.httpd.stats.update(requests=0, bytes=0)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,43 @@
+"""生成带可选中文本的多页 PDF，用作基准测试的 fixture（无需额外依赖）"""
+import sys
+
+
+def make_pdf(path, pages, lines=40):
+    objects = {
+        1: "<< /Type /Catalog /Pages 2 0 R >>",
+        3: "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    kids = []
+    next_id = 4
+    for page in range(pages):
+        rows = " ".join(
+            f"(Page {page + 1} line {line}: policy gradient methods optimise the expected return.) '"
+            for line in range(lines)
+        )
+        # 页眉页脚，便于测试 filter_pages
+        text = f"BT /F1 10 Tf 50 780 Td 12 TL (Journal of Benchmarks) ' {rows} ({page + 1}) ' ET"
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        objects[content_id] = f"<< /Length {len(text)} >>\nstream\n{text}\nendstream"
+        objects[page_id] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {content_id} 0 R "
+                            f"/Resources << /Font << /F1 3 0 R >> >> >>")
+        kids.append(f"{page_id} 0 R")
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>"
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(output)
+        output += f"{object_id} 0 obj\n{objects[object_id]}\nendobj\n".encode("latin-1")
+    xref = len(output)
+    output += f"xref\n0 {next_id}\n0000000000 65535 f \n".encode()
+    for object_id in range(1, next_id):
+        output += f"{offsets[object_id]:010d} 00000 n \n".encode()
+    output += (f"trailer\n<< /Size {next_id} /Root 1 0 R /Info << /Title (Benchmark) >> >>\n"
+               f"startxref\n{xref}\n%%EOF\n").encode()
+    with open(path, "wb") as f:
+        f.write(output)
+
+
+if __name__ == "__main__":
+    make_pdf(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 50)
@@ -0,0 +1,284 @@
+"""离线端到端基准测试
+
+在本地替身环境中运行真实的代码路径：
+- 假模型服务（OpenAI 兼容 SSE，可配置首 token 延迟、输出速率和 reasoning_content，可模拟慢端点和 503）
+- 假搜索后端 + 本地 HTTP 服务器（fixtures/pages 中录制的页面）
+- 自动生成的多页 PDF（本地解析，以及经本地 HTTP 服务器流式下载后由 parse_arxiv_xml 解析）
+
+用法：
+    python bench/run_bench.py                  # 运行并与 bench/baseline.json 对比
+    python bench/run_bench.py --save-baseline  # 把本次结果保存为基线
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from openai import OpenAI
+
+import context_builder
+import fake_search
+import hedging
+import page_cache
+import pdf_extract
+import search_api
+from fake_openai import FakeOpenAIServer
+from fixture_server import FixtureServer
+from make_pdf import make_pdf
+from stream_render import StreamRenderer
+
+PAGES_DIR = os.path.join(BENCH_DIR, "fixtures", "pages")
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+QUERY = "策略梯度方法有哪些"
+
+HIGHER_IS_BETTER = {"pdf.pages_per_s", "pdf.mb_per_s", "arxiv_pdf.pages_per_s", "arxiv_pdf.mb_per_s",
+                    "stream.tokens_per_s"}
+INFORMATIONAL = {"search.references", "turn.references", "stream.tokens", "stream.renders", "context.messages"}
+REGRESSION_THRESHOLD = 0.2  # 变差超过20%时标记
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+class NullContainer:
+    """代替 streamlit 容器，只统计渲染次数，用来测量渲染层本身的开销"""
+
+    def __init__(self):
+        self.renders = 0
+
+    def empty(self):
+        return self
+
+    def markdown(self, text):
+        self.renders += 1
+
+
+def bench_search(fixtures):
+    page_cache.clear()
+    start = time.perf_counter()
+    references = search_api.search_results(QUERY)
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    search_api.search_results(QUERY)
+    warm = time.perf_counter() - start
+    return {"search.cold_s": cold, "search.warm_s": warm, "search.references": len(references)}
+
+
+def bench_context():
+    reference = {"type": "reference", "reference": [
+        {"title": f"来源{i}", "link": f"http://example.com/{i}", "content": "策略梯度方法的推导与实现细节。" * 400}
+        for i in range(4)
+    ]}
+    messages = []
+    for i in range(100):
+        messages.append({"role": "user", "content": [{"type": "text", "text": f"第{i}个问题"}, reference]})
+        messages.append({"role": "assistant", "content": "这是一个较长的回答。" * 200})
+    budget = context_builder.context_budget("deepseek-ai/DeepSeek-R1", 8192)
+    cache = {}
+    start = time.perf_counter()
+    context_builder.build_context(messages, False, budget, cache)
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    _, report = context_builder.build_context(messages, False, budget, cache)
+    warm = time.perf_counter() - start
+    return {"context.cold_s": cold, "context.warm_s": warm, "context.messages": report["messages"]}
+
+
+def bench_stream(api):
+    client = OpenAI(base_url=api.base_url, api_key="bench")
+    answer, reasoning = NullContainer(), NullContainer()
+    answer_renderer, reasoning_renderer = StreamRenderer(answer), StreamRenderer(reasoning)
+    render_seconds = 0.0
+    tokens = 0
+    ttft = None
+    start = time.perf_counter()
+    stream = client.chat.completions.create(
+        model="deepseek-ai/DeepSeek-R1", messages=[{"role": "user", "content": QUERY}], stream=True)
+    for chunk in stream:
+        delta = chunk.choices[0].delta
+        text = delta.content or getattr(delta, "reasoning_content", None) or ""
+        if not text:
+            continue
+        if ttft is None:
+            ttft = time.perf_counter() - start
+        tokens += 1
+        render_start = time.perf_counter()
+        (answer_renderer if delta.content else reasoning_renderer).feed(text)
+        render_seconds += time.perf_counter() - render_start
+    render_start = time.perf_counter()
+    answer_renderer.finish()
+    reasoning_renderer.finish()
+    render_seconds += time.perf_counter() - render_start
+    total = time.perf_counter() - start
+    return {
+        "stream.ttft_s": ttft,
+        "stream.total_s": total,
+        "stream.tokens": tokens,
+        "stream.tokens_per_s": tokens / total,
+        "stream.render_us_per_token": render_seconds / max(tokens, 1) * 1e6,
+        "stream.renders": answer.renders + reasoning.renders,
+    }
+
+
+def bench_hedging(args):
+    """主端点首token异常缓慢或返回503时，对冲和故障转移后的首token延迟"""
+    primary = "deepseek-ai/DeepSeek-R1"
+    request = {"model": primary, "messages": [{"role": "user", "content": QUERY}]}
+    results = {}
+    # 近期样本：主端点平时很快，本次异常缓慢
+    for _ in range(hedging.HEDGE_MIN_SAMPLES):
+        hedging.record_ttft(primary, args.ttft)
+    with FakeOpenAIServer(args.ttft, args.token_rate, 10, 10, model_ttft={primary: args.slow_ttft}) as api:
+        client = OpenAI(base_url=api.base_url, api_key="bench")
+        for name, percentile in (("hedged", hedging.HEDGE_PERCENTILE), ("unhedged", None)):
+            start = time.perf_counter()
+            _, _, _, stream = hedging.open_stream(client, request, percentile)
+            results[f"hedge.{name}_ttft_s"] = time.perf_counter() - start
+            stream.close()
+    with FakeOpenAIServer(args.ttft, args.token_rate, 10, 10, failing_models={primary}) as api:
+        client = OpenAI(base_url=api.base_url, api_key="bench")
+        start = time.perf_counter()
+        _, _, _, stream = hedging.open_stream(client, request)
+        results["hedge.failover_ttft_s"] = time.perf_counter() - start
+        stream.close()
+    return results
+
+
+def bench_turn(api):
+    """通过 streamlit AppTest 运行 GUI.py 的完整一轮（含网络搜索）"""
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        return {}
+    os.environ["SILICONFLOW_BASE_URL"] = api.base_url
+    os.environ.setdefault("SILICONFLOW_API_KEY", "bench")
+    page_cache.clear()
+    app = AppTest.from_file(os.path.join(ROOT_DIR, "GUI.py"), default_timeout=120)
+    start = time.perf_counter()
+    app.run()
+    rerun = time.perf_counter() - start
+    app.sidebar.checkbox[0].check().run()
+    start = time.perf_counter()
+    app.chat_input[0].set_value(QUERY).run()
+    turn = time.perf_counter() - start
+    if app.exception:
+        print(f"GUI运行出错: {app.exception}")
+    message = app.session_state.messages[0] if app.session_state.messages else {}
+    references = [item for item in message.get("content", []) if isinstance(item, dict) and item.get("type") == "reference"]
+    return {
+        "turn.rerun_s": rerun,
+        "turn.total_s": turn,
+        "turn.references": len(references[0]["reference"]) if references else 0,
+    }
+
+
+def bench_pdf(pages):
+    path = os.path.join(os.getcwd(), "bench.pdf")
+    make_pdf(path, pages)
+    size = os.path.getsize(path)
+    start = time.perf_counter()
+    pdf_extract.process_pdf(path, output_path=os.path.join(os.getcwd(), "output", "bench.txt"))
+    elapsed = time.perf_counter() - start
+    return {"pdf.seconds": elapsed, "pdf.pages_per_s": pages / elapsed, "pdf.mb_per_s": size / elapsed / 1e6}
+
+
+def bench_arxiv_pdf(pages):
+    """arXiv 全文模式：经本地服务器流式下载 bench_pdf 生成的 PDF（含大小上限检查），再解析文本"""
+    path = os.path.join(os.getcwd(), "bench.pdf")
+    size = os.path.getsize(path)
+    with FixtureServer(os.getcwd()) as server:
+        feed = (f'<feed xmlns="http://www.w3.org/2005/Atom"><entry>'
+                f'<id>http://arxiv.org/abs/2401.00001v1</id><title>Benchmark</title><summary>摘要</summary>'
+                f'<link title="pdf" href="{server.base_url}/bench.pdf"/></entry></feed>')
+        start = time.perf_counter()
+        text = search_api.parse_arxiv_xml(feed, True)
+        elapsed = time.perf_counter() - start
+        downloaded = server.stats["bytes"]
+    if downloaded != size or text == "摘要":
+        raise RuntimeError("PDF 下载失败，parse_arxiv_xml 退回了摘要")
+    return {"arxiv_pdf.seconds": elapsed, "arxiv_pdf.pages_per_s": pages / elapsed,
+            "arxiv_pdf.mb_per_s": size / elapsed / 1e6}
+
+
+def compare(results, baseline):
+    print(f"\n{'指标':<28}{'基线':>12}{'本次':>12}{'变化':>10}")
+    regressions = []
+    for key, value in results.items():
+        old = baseline.get(key)
+        if old is None or value is None or key in INFORMATIONAL or not old:
+            print(f"{key:<28}{'-' if old is None else f'{old:.4g}':>12}{value if value is None else f'{value:.4g}':>12}")
+            continue
+        change = (value - old) / old
+        worse = -change if key in HIGHER_IS_BETTER else change
+        flag = " ⚠️" if worse > REGRESSION_THRESHOLD else ""
+        if flag:
+            regressions.append(key)
+        print(f"{key:<28}{old:>12.4g}{value:>12.4g}{change:>+10.0%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线端到端基准测试")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基线")
+    parser.add_argument("--ttft", type=float, default=0.3, help="假模型的首 token 延迟（秒）")
+    parser.add_argument("--token-rate", type=float, default=200, help="假模型每秒输出的 token 数")
+    parser.add_argument("--reasoning-tokens", type=int, default=100)
+    parser.add_argument("--answer-tokens", type=int, default=300)
+    parser.add_argument("--slow-ttft", type=float, default=3.0, help="对冲场景中主端点的首 token 延迟（秒）")
+    parser.add_argument("--pdf-pages", type=int, default=100)
+    parser.add_argument("--skip-gui", action="store_true", help="不运行 GUI.py 的完整一轮")
+    args = parser.parse_args()
+
+    # 在临时目录中运行，避免写入真实的对话记录和缓存
+    work_dir = tempfile.mkdtemp(prefix="deepseek_gui_bench_")
+    os.chdir(work_dir)
+    pages = sorted(f for f in os.listdir(PAGES_DIR) if f.endswith(".html"))
+    results = {}
+    try:
+        with FixtureServer(PAGES_DIR) as fixtures, FakeOpenAIServer(
+                args.ttft, args.token_rate, args.reasoning_tokens, args.answer_tokens) as api:
+            fake_search.install(search_api, fixtures.base_url, pages)
+            results.update(bench_search(fixtures))
+            results.update(bench_context())
+            results.update(bench_stream(api))
+            results.update(bench_hedging(args))
+            if not args.skip_gui:
+                results.update(bench_turn(api))
+        results.update(bench_pdf(args.pdf_pages))
+        results.update(bench_arxiv_pdf(args.pdf_pages))
+        results["peak_rss_mb"] = peak_rss_mb()
+    finally:
+        os.chdir(ROOT_DIR)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline)
+    if args.save_baseline:
+        with open(BASELINE_FILE, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n已保存基线到 {BASELINE_FILE}")
+    elif regressions:
+        print(f"\n⚠️ 以下指标比基线变差超过 {REGRESSION_THRESHOLD:.0%}：{', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
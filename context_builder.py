@@ -0,0 +1,206 @@
+"""按 token 预算构造发送给模型的上下文
+
+每条消息的 token 数只估算一次（按消息对象缓存）。超出预算时依次：
+1. 省略较早消息中的参考资料正文（只保留标题和链接）
+2. 省略较早消息中的图片
+3. 从最早的消息开始丢弃
+最近 KEEP_RECENT 条消息始终原样保留。
+"""
+import math
+import re
+
+import image_store
+
+# 各模型的上下文长度（token）
+MODEL_CONTEXT = {
+    "deepseek-ai/DeepSeek-R1": 65536,
+    "deepseek-ai/DeepSeek-V3": 65536,
+    "Pro/deepseek-ai/DeepSeek-R1": 65536,
+    "Pro/deepseek-ai/DeepSeek-V3": 65536,
+    "Qwen/Qwen3-235B-A22B": 131072,
+    "Qwen/Qwen3-32B": 131072,
+    "Qwen/Qwen2.5-VL-72B-Instruct": 32768,
+}
+DEFAULT_CONTEXT = 32768
+CONTEXT_MARGIN = 1024       # 为消息格式等额外开销预留
+KEEP_RECENT = 2             # 原样保留的最近消息数
+REF_CHARS = 4096            # 每条参考资料最多引用的字数
+
+# Qwen2.5-VL 每 28x28 像素对应一个 token
+IMAGE_PATCH = 28
+IMAGE_MAX_TOKENS = 16384
+DEFAULT_IMAGE_TOKENS = 1024
+
+CJK = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中日韩字符约 0.6 token/字，其他字符约 0.3 token/字"""
+    if not text:
+        return 0
+    cjk = len(CJK.findall(text))
+    return math.ceil(cjk * 0.6 + (len(text) - cjk) * 0.3)
+
+
+def image_tokens(item):
+    if item.get("type") != "image":
+        return DEFAULT_IMAGE_TOKENS
+    try:
+        from PIL import Image  # 只在历史中有图片时才需要
+        with Image.open(image_store.image_path(item["image_id"])) as image:
+            width, height = image.size
+    except Exception:
+        return DEFAULT_IMAGE_TOKENS
+    return min(IMAGE_MAX_TOKENS, math.ceil(width / IMAGE_PATCH) * math.ceil(height / IMAGE_PATCH))
+
+
+def context_budget(model, max_tokens):
+    """上下文预算 = 模型上下文长度 - 最大生成长度 - 预留"""
+    return MODEL_CONTEXT.get(model, DEFAULT_CONTEXT) - max_tokens - CONTEXT_MARGIN
+
+
+def format_reference(ref, index):
+    return (f"{index + 1}. {ref.get('content', '')[:REF_CHARS]}\n\n"
+            f"来源：{ref.get('title', '无标题')} ({ref.get('link', '无链接')})\n\n")
+
+
+def format_reference_title(ref, index):
+    return f"{index + 1}. {ref.get('title', '无标题')} ({ref.get('link', '无链接')})\n"
+
+
+def convert_message(msg, use_vlm, keep_references=True, keep_images=True):
+    """转换单条消息的格式；keep_* 为 False 时省略参考资料正文/图片"""
+    if use_vlm:
+        if isinstance(msg["content"], list):
+            content = []
+            for item in msg["content"]:
+                if item["type"] in ("image", "image_url") and not keep_images:
+                    content.append({"type": "text", "text": "[图片已省略]"})
+                elif item["type"] == "image":
+                    # 图片只在发送给VLM时才编码为data URL
+                    content.append({"type": "image_url", "image_url": {"url": image_store.data_url(item["image_id"])}})
+                elif item["type"] == "image_url":
+                    content.append({"type": "image_url", "image_url": {"url": item["image_url"]["url"]}})
+                elif item["type"] == "text":
+                    content.append({"type": "text", "text": item.get("text", "")})
+        else:
+            content = [{"type": "text", "text": str(msg["content"])}]
+    else:
+        if isinstance(msg["content"], list):
+            ref_text = ""
+            content = ""
+            for item in msg["content"]:
+                if item.get("type") == "reference":
+                    refs = item.get("reference", [])
+                    if keep_references:
+                        ref_text = "\n\n【相关参考资料】\n" + "".join(format_reference(ref, i) for i, ref in enumerate(refs))
+                    elif refs:
+                        ref_text = "\n\n【相关参考资料（正文已省略）】\n" + "".join(
+                            format_reference_title(ref, i) for i, ref in enumerate(refs))
+            if ref_text:
+                content = ref_text + "原输入：\n"
+            text_parts = [item["text"] for item in msg["content"] if item.get("type") == "text"]
+            content += " ".join(text_parts)
+        else:
+            content = msg["content"]
+    return {"role": msg["role"], "content": content}
+
+
+def message_tokens(msg, cache=None):
+    """统计单条消息各部分的 token 数，结果按消息对象缓存"""
+    if cache is not None:
+        cached = cache.get(id(msg))
+        if cached is not None and cached[0] is msg:
+            return cached[1]
+    counts = {"text": 0, "reference": 0, "reference_title": 0, "image": 0}
+    if isinstance(msg["content"], list):
+        for item in msg["content"]:
+            if item.get("type") == "text":
+                counts["text"] += estimate_tokens(item.get("text", ""))
+            elif item.get("type") == "reference":
+                for i, ref in enumerate(item.get("reference", [])):
+                    counts["reference"] += estimate_tokens(format_reference(ref, i))
+                    counts["reference_title"] += estimate_tokens(format_reference_title(ref, i))
+            elif item.get("type") in ("image", "image_url"):
+                counts["image"] += image_tokens(item)
+    else:
+        counts["text"] = estimate_tokens(str(msg["content"]))
+    if cache is not None:
+        cache[id(msg)] = (msg, counts)
+    return counts
+
+
+def build_context(messages, use_vlm, budget, cache=None):
+    """在预算内构造上下文，返回 (api_messages, report)"""
+    counts = [message_tokens(msg, cache) for msg in messages]
+    n = len(messages)
+    keep_references = [True] * n
+    keep_images = [True] * n
+
+    def cost(i):
+        c = counts[i]
+        if use_vlm:
+            return c["text"] + (c["image"] if keep_images[i] else 0)
+        return c["text"] + (c["reference"] if keep_references[i] else c["reference_title"])
+
+    total = sum(cost(i) for i in range(n))
+    protected = max(0, n - KEEP_RECENT)
+
+    # 1. 省略较早消息的参考资料正文
+    for i in range(protected):
+        if total <= budget:
+            break
+        if not use_vlm and counts[i]["reference"]:
+            total -= cost(i)
+            keep_references[i] = False
+            total += cost(i)
+    # 2. 省略较早消息的图片
+    for i in range(protected):
+        if total <= budget:
+            break
+        if use_vlm and counts[i]["image"]:
+            total -= cost(i)
+            keep_images[i] = False
+            total += cost(i)
+    # 3. 丢弃最早的消息（至少保留最后一条），并保证从用户消息开始
+    start = 0
+    while start < n - 1 and total > budget:
+        total -= cost(start)
+        start += 1
+    while start < n - 1 and messages[start]["role"] != "user":
+        total -= cost(start)
+        start += 1
+
+    api_messages = [
+        convert_message(messages[i], use_vlm, keep_references[i], keep_images[i]) for i in range(start, n)
+    ]
+    report = {
+        "budget": budget,
+        "total": total,
+        "text": sum(counts[i]["text"] for i in range(start, n)),
+        "reference": 0 if use_vlm else sum(
+            counts[i]["reference"] if keep_references[i] else counts[i]["reference_title"] for i in range(start, n)),
+        "image": sum(counts[i]["image"] for i in range(start, n) if keep_images[i]) if use_vlm else 0,
+        "messages": n - start,
+        "dropped_messages": start,
+        "stripped_references": sum(1 for i in range(start, n) if not keep_references[i]),
+        "stripped_images": sum(1 for i in range(start, n) if not keep_images[i]),
+    }
+    return api_messages, report
+
+
+def format_report(report):
+    """上下文用量的一行摘要"""
+    text = (f"上下文约 {report['total']} / {report['budget']} tokens："
+            f"对话 {report['text']}，参考资料 {report['reference']}，图片 {report['image']}"
+            f"（{report['messages']} 条消息）")
+    omitted = []
+    if report["dropped_messages"]:
+        omitted.append(f"丢弃最早的 {report['dropped_messages']} 条消息")
+    if report["stripped_references"]:
+        omitted.append(f"省略 {report['stripped_references']} 条消息的参考资料正文")
+    if report["stripped_images"]:
+        omitted.append(f"省略 {report['stripped_images']} 条消息的图片")
+    if omitted:
+        text += "；为控制长度已" + "、".join(omitted)
+    return text
@@ -0,0 +1,374 @@
+"""对话记录存储（JSONL，每行一条消息，只追加）
+
+- 保存时只追加新增的消息，写入后 fsync；崩溃时最多留下半行，读取和下次追加时会自动丢弃
+- 兼容旧版 ChatHistory/*.json：迁移为 .jsonl 后，原文件移入 legacy 目录
+- 对话目录（标题、时间、大小、消息数）保存在 SQLite 中，随保存和删除增量更新，
+  侧边栏分页直接查询目录，无需扫描文件夹
+- 全文检索使用 FTS5 trigram 分词（对中文按三字切分），覆盖消息、推理过程和参考资料标题；
+  两个字的检索词（多数中文词语）查询按二字切分的辅助索引，只有单字才退化为逐行匹配
+"""
+import json
+import os
+import re
+import secrets
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+HISTORY_DIR = "ChatHistory"
+LEGACY_DIR = os.path.join(HISTORY_DIR, "legacy")
+CATALOG_FILE = os.path.join(HISTORY_DIR, "catalog.db")
+EXT = ".jsonl"
+SNIPPET_WIDTH = 60   # 检索结果摘要的字数
+
+_local = threading.local()
+
+
+def convo_path(name):
+    return os.path.join(HISTORY_DIR, name + EXT)
+
+
+def exists(name):
+    return os.path.exists(convo_path(name))
+
+
+def new_name():
+    """新对话的ID，形如 MMDDHHMM-3f9a1c；标题单独保存在对话目录中"""
+    return f"{datetime.now().strftime('%m%d%H%M')}-{secrets.token_hex(3)}"
+
+
+def title_of(name):
+    """旧版对话名称形如 MMDDHHMM_标题"""
+    return name.split('_', 1)[1] if '_' in name else name
+
+
+def provisional_title(text):
+    """标题生成前使用的临时标题"""
+    return re.sub(r'\s+', ' ', text).strip()[:15] or "未命名"
+
+
+def _connect():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        os.makedirs(HISTORY_DIR, exist_ok=True)
+        conn = sqlite3.connect(CATALOG_FILE, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        created = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversations'"
+        ).fetchone() is None
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                name TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                size INTEGER NOT NULL,
+                message_count INTEGER NOT NULL
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_updated ON conversations(updated_at)")
+        index_created = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'"
+        ).fetchone() is None
+        index_created = index_created or conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'bigram_index'"
+        ).fetchone() is None
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_index "
+            "USING fts5(name UNINDEXED, kind UNINDEXED, text, tokenize='trigram')"
+        )
+        # 与 search_index 同 rowid，grams 为文本按两字切分后以空格连接的结果
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS bigram_index "
+            "USING fts5(name UNINDEXED, grams, tokenize='unicode61')"
+        )
+        conn.commit()
+        _local.conn = conn
+        if created or index_created:
+            rebuild_catalog()
+    return conn
+
+
+def _index_rows(name, messages):
+    """提取消息中需要检索的文本：正文、推理过程、参考资料标题"""
+    for msg in messages:
+        role = msg.get("role", "user")
+        content = msg.get("content")
+        if isinstance(content, list):
+            texts = [item.get("text", "") for item in content if item.get("type") == "text"]
+            if texts:
+                yield name, role, " ".join(texts)
+            for item in content:
+                if item.get("type") == "reference":
+                    titles = [ref.get("title", "") for ref in item.get("reference", [])]
+                    if titles:
+                        yield name, "reference", "\n".join(titles)
+        elif content:
+            yield name, role, str(content)
+        if msg.get("reasoning"):
+            yield name, "reasoning", msg["reasoning"]
+
+
+def bigrams(text):
+    """相邻两个字（字母、数字或汉字）组成一个词，其余字符作为分隔"""
+    text = text.lower()
+    return " ".join(text[i:i + 2] for i in range(len(text) - 1)
+                    if text[i].isalnum() and text[i + 1].isalnum())
+
+
+def _index_messages(conn, name, messages):
+    for row in _index_rows(name, messages):
+        rowid = conn.execute("INSERT INTO search_index (name, kind, text) VALUES (?, ?, ?)", row).lastrowid
+        conn.execute("INSERT INTO bigram_index (rowid, name, grams) VALUES (?, ?, ?)",
+                     (rowid, name, bigrams(row[2])))
+
+
+def _catalog_add(name, messages, size, title=None):
+    """在目录中登记一次保存：累加消息数，更新大小与时间，并索引新消息"""
+    now = time.time()
+    conn = _connect()
+    _index_messages(conn, name, messages)
+    conn.execute(
+        "INSERT INTO conversations (name, title, created_at, updated_at, size, message_count) "
+        "VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET updated_at = excluded.updated_at, size = excluded.size, "
+        "message_count = message_count + excluded.message_count",
+        (name, title or title_of(name), now, now, size, len(messages))
+    )
+    conn.commit()
+
+
+def rebuild_catalog():
+    """扫描对话文件重建目录和检索索引（首次创建时调用）"""
+    conn = _connect()
+    conn.execute("DELETE FROM conversations")
+    conn.execute("DELETE FROM search_index")
+    conn.execute("DELETE FROM bigram_index")
+    for filename in os.listdir(HISTORY_DIR):
+        if not filename.endswith(EXT):
+            continue
+        path = os.path.join(HISTORY_DIR, filename)
+        stat = os.stat(path)
+        if stat.st_size == 0:
+            continue
+        name = filename[:-len(EXT)]
+        messages = load_messages(name)
+        if '_' in name:
+            title = title_of(name)
+        else:
+            first = next((text for _, role, text in _index_rows(name, messages[:1]) if role == "user"), "")
+            title = provisional_title(first)
+        conn.execute(
+            "INSERT OR REPLACE INTO conversations (name, title, created_at, updated_at, size, message_count) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (name, title, stat.st_mtime, stat.st_mtime, stat.st_size, len(messages))
+        )
+        _index_messages(conn, name, messages)
+    conn.commit()
+
+
+def list_conversations(limit=None, offset=0):
+    """按最近更新时间倒序分页查询对话目录"""
+    rows = _connect().execute(
+        "SELECT name, title, created_at, updated_at, size, message_count FROM conversations "
+        "ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+        (-1 if limit is None else limit, offset)
+    ).fetchall()
+    keys = ('name', 'title', 'created_at', 'updated_at', 'size', 'message_count')
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def set_title(name, title):
+    conn = _connect()
+    conn.execute("UPDATE conversations SET title = ? WHERE name = ?", (title, name))
+    conn.commit()
+
+
+def count_conversations():
+    return _connect().execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+
+def _repair_tail(f):
+    """截掉上次写入中断留下的半行"""
+    size = f.seek(0, os.SEEK_END)
+    if size == 0:
+        return
+    f.seek(size - 1)
+    if f.read(1) == b'\n':
+        return
+    pos = size
+    while pos > 0:
+        step = min(4096, pos)
+        pos -= step
+        f.seek(pos)
+        chunk = f.read(step)
+        idx = chunk.rfind(b'\n')
+        if idx != -1:
+            f.truncate(pos + idx + 1)
+            return
+    f.truncate(0)
+
+
+def append_messages(name, messages, title=None):
+    """把消息追加到对话文件末尾，一次写入并fsync；title 仅在新建目录项时使用"""
+    if not messages:
+        return
+    # 先打开目录：首次创建目录时会扫描文件重建，必须在写入之前，否则本次的消息会被登记两次
+    _connect()
+    data = b''.join(
+        (json.dumps(msg, ensure_ascii=False) + '\n').encode('utf-8') for msg in messages
+    )
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    with open(convo_path(name), 'a+b') as f:
+        _repair_tail(f)
+        f.seek(0, os.SEEK_END)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    _catalog_add(name, messages, size, title)
+
+
+def _line_offsets(path):
+    """扫描换行符得到每条完整消息的起止位置（不解析JSON）"""
+    offsets = []
+    start = 0
+    pos = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            idx = chunk.find(b'\n')
+            while idx != -1:
+                offsets.append((start, pos + idx + 1))
+                start = pos + idx + 1
+                idx = chunk.find(b'\n', idx + 1)
+            pos += len(chunk)
+    return offsets
+
+
+def count_messages(name):
+    if not exists(name):
+        return 0
+    return len(_line_offsets(convo_path(name)))
+
+
+def load_messages(name):
+    """逐行读取全部消息，忽略末尾不完整的行"""
+    path = convo_path(name)
+    messages = []
+    if not os.path.exists(path):
+        return messages
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            messages.append(json.loads(line))
+    return messages
+
+
+def delete(name):
+    if exists(name):
+        os.remove(convo_path(name))
+    conn = _connect()
+    conn.execute("DELETE FROM conversations WHERE name = ?", (name,))
+    conn.execute("DELETE FROM search_index WHERE name = ?", (name,))
+    conn.execute("DELETE FROM bigram_index WHERE name = ?", (name,))
+    conn.commit()
+
+
+def migrate_legacy():
+    """把旧版整文件JSON对话迁移为JSONL，返回迁移数量"""
+    migrated = 0
+    conn = _connect()   # 同 append_messages，目录的首次重建要早于迁移写入
+    for filename in os.listdir(HISTORY_DIR):
+        if not filename.endswith('.json'):
+            continue
+        path = os.path.join(HISTORY_DIR, filename)
+        name = filename[:-len('.json')]
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                messages = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"迁移失败 {filename}: {str(e)}")
+            continue
+        if not exists(name):
+            tmp_path = convo_path(name) + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                for msg in messages:
+                    f.write((json.dumps(msg, ensure_ascii=False) + '\n').encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, convo_path(name))
+            # 保留原文件的修改时间，便于按时间排序
+            shutil.copystat(path, convo_path(name))
+            mtime = os.path.getmtime(path)
+            conn.execute(
+                "INSERT OR REPLACE INTO conversations (name, title, created_at, updated_at, size, message_count) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (name, title_of(name), mtime, mtime, os.path.getsize(convo_path(name)), len(messages))
+            )
+            _index_messages(conn, name, messages)
+            conn.commit()
+        os.makedirs(LEGACY_DIR, exist_ok=True)
+        os.replace(path, os.path.join(LEGACY_DIR, filename))
+        migrated += 1
+    return migrated
+
+
+def make_snippet(text, terms, width=SNIPPET_WIDTH):
+    """截取第一个命中词附近的文本，并加粗命中词"""
+    lower = text.lower()
+    hits = [pos for pos in (lower.find(term.lower()) for term in terms) if pos != -1]
+    pos = min(hits) if hits else 0
+    start = max(0, pos - width // 3)
+    fragment = text[start:start + width].replace("\n", " ")
+    pattern = re.compile("|".join(re.escape(term) for term in terms), re.IGNORECASE)
+    fragment = pattern.sub(lambda m: f"**{m.group(0)}**", fragment)
+    return ("…" if start > 0 else "") + fragment + ("…" if start + width < len(text) else "")
+
+
+def search(query, limit=20):
+    """全文检索对话，返回按相关度排序的 [{'name', 'title', 'kind', 'snippet'}]，每个对话只保留最佳命中"""
+    terms = [term for term in query.split() if term]
+    if not terms:
+        return []
+    long_terms = [term for term in terms if len(term) >= 3]
+    pair_terms = [term for term in terms if len(term) == 2 and term.isalnum()]
+    short_terms = [term for term in terms if len(term) < 3 and term not in pair_terms]
+
+    where = []
+    params = []
+    if long_terms:
+        where.append("search_index MATCH ?")
+        params.append(" AND ".join('"' + term.replace('"', '""') + '"' for term in long_terms))
+    if pair_terms:
+        # trigram 索引无法匹配两个字的词，改查二字索引
+        where.append("s.rowid IN (SELECT rowid FROM bigram_index WHERE bigram_index MATCH ?)")
+        params.append(" AND ".join('"' + term.lower() + '"' for term in pair_terms))
+    for term in short_terms:
+        # 单字或含标点的短词无法使用索引，逐行查找
+        where.append("instr(lower(text), ?) > 0")
+        params.append(term.lower())
+    order = "bm25(search_index)" if long_terms else "c.updated_at DESC"
+    rows = _connect().execute(
+        "SELECT s.name, c.title, s.kind, s.text FROM search_index s "
+        "JOIN conversations c ON c.name = s.name "
+        f"WHERE {' AND '.join(where)} ORDER BY {order} LIMIT ?",
+        params + [limit * 5]
+    ).fetchall()
+
+    results = []
+    seen = set()
+    for name, title, kind, text in rows:
+        if name in seen:
+            continue
+        seen.add(name)
+        results.append({
+            'name': name,
+            'title': title,
+            'kind': kind,
+            'snippet': make_snippet(text, terms)
+        })
+        if len(results) >= limit:
+            break
+    return results
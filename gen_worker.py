@@ -0,0 +1,239 @@
+"""后台生成任务
+
+回答在后台线程池中生成，与 streamlit 的脚本运行解耦：重跑、切换对话或刷新页面都不会中断生成。
+- 任务按对话名登记，增量写入共享缓冲区，界面可随时从任意偏移量接着读取
+- 生成结束后由工作线程把回答追加到对话记录，界面是否在线都不影响保存；对话被删除时取消生成且不再保存
+- 线程池大小限制全局并发，超出的请求按到达顺序排队；所有使用同一 API key 的请求共享一个令牌桶限速
+- 请求通过 hedging 发出，可在配对的模型端点之间对冲和故障转移
+"""
+import itertools
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import convo_store
+import hedging
+import tracing
+
+MAX_CONCURRENT = int(os.getenv("API_MAX_CONCURRENT", 4))     # 同时进行的生成数
+RATE_PER_MINUTE = float(os.getenv("API_RATE_PER_MINUTE", 60)) # 每分钟请求数上限
+RATE_BURST = int(os.getenv("API_RATE_BURST", 10))             # 允许的突发请求数
+JOB_TTL = 600           # 结束的任务保留时间（秒），用于刷新后回放
+READ_TIMEOUT = 0.1      # 界面等待新内容的最长时间（秒）
+
+QUEUED, RUNNING, DONE, ERROR, CANCELLED = "queued", "running", "done", "error", "cancelled"
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多积累 capacity 个。
+
+    令牌不足时先预约（令牌数可为负）再等待，因此等待的请求按预约顺序依次放行。
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """预约一个令牌，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+class Job:
+    """一次回答的生成任务；events 为按到达顺序的 (类型, 文本) 增量，类型为 reasoning 或 answer"""
+
+    def __init__(self, key, model):
+        self.id = uuid.uuid4().hex[:12]
+        self.key = key
+        self.model = model
+        self.status = QUEUED
+        self.events = []
+        self.message = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.served_model = None    # 实际响应的模型
+        self.route = None           # primary / hedge / failover
+        self.discarded = False      # 对话已被删除，不再保存回答
+        self._cancel = threading.Event()
+        self._cond = threading.Condition()
+        self._save_lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.status in (DONE, ERROR, CANCELLED)
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def discard(self):
+        """对话被删除时调用：取消生成并放弃保存；返回时保存要么已完成，要么不会再发生"""
+        with self._save_lock:
+            self.discarded = True
+        self.cancel()
+
+    def _append(self, kind, text):
+        with self._cond:
+            self.events.append((kind, text))
+            self._cond.notify_all()
+
+    def _finish(self, status, message, error=None):
+        with self._cond:
+            self.message = message
+            self.error = error
+            self.finished = time.time()
+            self.status = status
+            self._cond.notify_all()
+
+    def read(self, offset, timeout=READ_TIMEOUT):
+        """返回第 offset 个之后的增量；暂无新内容时最多等待 timeout 秒"""
+        with self._cond:
+            if len(self.events) <= offset and not self.done:
+                self._cond.wait(timeout)
+            return self.events[offset:]
+
+
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT, thread_name_prefix="generate")
+_bucket = TokenBucket(RATE_PER_MINUTE / 60, RATE_BURST)
+_jobs = {}      # 对话名 -> 最近一次的任务
+_lock = threading.Lock()
+
+
+def throttle():
+    """所有使用共享 API key 的请求在发出前调用，返回因限速等待的秒数"""
+    return _bucket.acquire()
+
+
+def _purge():
+    now = time.time()
+    for key, job in list(_jobs.items()):
+        if job.done and now - job.finished > JOB_TTL:
+            del _jobs[key]
+
+
+def get(key):
+    """获取对话最近一次的生成任务"""
+    if key is None:
+        return None
+    with _lock:
+        _purge()
+        return _jobs.get(key)
+
+
+def discard(key):
+    """删除对话前调用：取消该对话正在进行的生成，且不再保存回答"""
+    job = get(key)
+    if job is not None:
+        job.discard()
+
+
+def queue_position(job):
+    """排在该任务之前、仍在等待的任务数"""
+    with _lock:
+        return sum(1 for other in _jobs.values() if other.status == QUEUED and other.created < job.created)
+
+
+def _run(job, client, request, context, hedge_percentile):
+    answer = ""
+    reasoning = ""
+    status, error = DONE, None
+    try:
+        if job.cancelled:
+            raise InterruptedError("生成已取消")
+        with tracing.span("chat_completion", model=job.model) as completion_span:
+            job.status = RUNNING
+            request_start = time.perf_counter()
+            job.served_model, job.route, head, stream = hedging.open_stream(
+                client, request, hedge_percentile, throttle, lambda: job.cancelled)
+            completion_span.update(served_model=job.served_model, route=job.route)
+
+            # 按增量块计数token
+            first_token = None
+            answer_tokens = reasoning_tokens = 0
+            for chunk in itertools.chain(head, stream):
+                if job.cancelled:
+                    stream.close()
+                    status = CANCELLED
+                    break
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                reasoning_delta = getattr(delta, 'reasoning_content', None) or ""
+                if first_token is None and (delta.content or reasoning_delta):
+                    first_token = time.perf_counter()
+                if reasoning_delta:
+                    reasoning_tokens += 1
+                    reasoning += reasoning_delta
+                    job._append("reasoning", reasoning_delta)
+                if delta.content:
+                    answer_tokens += 1
+                    answer += delta.content
+                    job._append("answer", delta.content)
+
+            request_end = time.perf_counter()
+            ttft = first_token - request_start if first_token else None
+            generation_seconds = request_end - (first_token or request_start)
+            completion_span.update(
+                ttft=ttft,
+                answer_tokens=answer_tokens,
+                reasoning_tokens=reasoning_tokens,
+                tokens_per_s=(answer_tokens + reasoning_tokens) / generation_seconds if generation_seconds else 0.0,
+                cancelled=status == CANCELLED
+            )
+            tracing.record("chat_ttft_seconds", ttft)
+            tracing.record("chat_tokens", answer_tokens + reasoning_tokens)
+        if status == CANCELLED and not answer:
+            answer = "已停止生成"
+        message = {"role": "assistant", "content": answer, "reasoning": reasoning.strip()}
+        if context is not None:
+            message["context"] = context
+    except Exception as e:
+        if job.cancelled:
+            status, error = CANCELLED, None
+            message = {"role": "assistant", "content": answer or "已停止生成", "reasoning": reasoning.strip()}
+        else:
+            print(f"生成失败 {job.key}: {str(e)}")
+            status, error = ERROR, str(e)
+            message = {"role": "assistant", "content": answer or "响应生成失败", "reasoning": f"错误信息: {str(e)}"}
+    # 不论界面是否还在显示，都由工作线程保存回答；对话已删除则不保存，以免重新创建记录
+    with job._save_lock:
+        if not job.discarded:
+            try:
+                convo_store.append_messages(job.key, [message])
+            except Exception as e:
+                print(f"保存回答失败 {job.key}: {str(e)}")
+    job._finish(status, message, error)
+
+
+def start(key, client, request, context=None, hedge_percentile=None):
+    """为对话提交一个生成任务；request 为 chat.completions.create 的参数（不含 stream），
+    hedge_percentile 不为 None 时启用对冲"""
+    job = Job(key, request["model"])
+    with _lock:
+        _purge()
+        previous = _jobs.get(key)
+        if previous and not previous.done:
+            raise RuntimeError("该对话已有正在生成的回答")
+        _jobs[key] = job
+    _executor.submit(tracing.bind(_run), job, client, request, context, hedge_percentile)
+    return job
@@ -0,0 +1,208 @@
+"""在等价的模型端点之间对冲和故障转移
+
+同一模型有普通和 Pro 两个端点（如 deepseek-ai/DeepSeek-R1 与 Pro/deepseek-ai/DeepSeek-R1）：
+- 对冲：首token在该模型近期首token延迟的某个分位数内仍未到达时，向配对端点发出同一请求，
+  采用先返回首token的一方，另一方立即关闭
+- 故障转移：请求因 5xx、超时或连接错误失败时，立即改用配对端点；429/408 先按退避重试，仍失败再切换
+"""
+import os
+import queue
+import socket
+import threading
+import time
+from collections import defaultdict, deque
+
+import tracing
+
+MODEL_PAIRS = {
+    "deepseek-ai/DeepSeek-R1": "Pro/deepseek-ai/DeepSeek-R1",
+    "Pro/deepseek-ai/DeepSeek-R1": "deepseek-ai/DeepSeek-R1",
+    "deepseek-ai/DeepSeek-V3": "Pro/deepseek-ai/DeepSeek-V3",
+    "Pro/deepseek-ai/DeepSeek-V3": "deepseek-ai/DeepSeek-V3",
+}
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 90))  # 对冲延迟取近期首token延迟的分位数
+HEDGE_DEFAULT_DELAY = 5.0   # 样本不足时的对冲延迟（秒）
+HEDGE_MIN_DELAY = 1.0
+HEDGE_MAX_DELAY = 15.0
+HEDGE_MIN_SAMPLES = 5
+TTFT_WINDOW = 200           # 每个模型保留的首token延迟样本数
+STREAM_TIMEOUT = 60         # 有配对端点时的请求超时（秒），超时后故障转移
+RATE_LIMIT_RETRIES = 2      # 429/408 在同一端点的重试次数（代替客户端自带的重试）
+RETRY_BACKOFF = 0.5         # 指数退避基数：0.5s, 1s ...
+MAX_RETRY_DELAY = 8.0
+POLL_INTERVAL = 0.1
+
+_ttfts = defaultdict(lambda: deque(maxlen=TTFT_WINDOW))
+_lock = threading.Lock()
+
+
+def record_ttft(model, seconds):
+    with _lock:
+        _ttfts[model].append(seconds)
+
+
+def hedge_delay(model, percentile=HEDGE_PERCENTILE):
+    """按该模型近期首token延迟的分位数计算对冲延迟"""
+    with _lock:
+        samples = sorted(_ttfts[model])
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    index = min(len(samples) - 1, int(len(samples) * percentile / 100))
+    return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, samples[index]))
+
+
+def is_retryable(error):
+    """5xx、429/408、超时和连接错误换端点重试；其余 4xx 是请求本身的问题，不重试"""
+    import openai
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500 or error.status_code in (408, 429)
+    return isinstance(error, openai.APIConnectionError)
+
+
+def _retry_delay(error, retry):
+    """优先使用 Retry-After 头，否则按指数退避"""
+    response = getattr(error, 'response', None)
+    try:
+        delay = float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        delay = RETRY_BACKOFF * 2 ** retry
+    return min(MAX_RETRY_DELAY, max(0.0, delay))
+
+
+def _close(stream):
+    """关闭流。另一线程可能正阻塞在读取上，仅 close() 不会中断它，也不会断开连接，
+    因此先关闭底层 socket，让读取立即返回、服务端立即停止生成"""
+    try:
+        network_stream = stream.response.extensions["network_stream"]
+        network_stream.get_extra_info("socket").shutdown(socket.SHUT_RDWR)
+    except Exception:
+        pass
+    try:
+        stream.close()
+    except Exception:
+        pass
+
+
+def _has_token(chunk):
+    if not chunk.choices:
+        return False
+    delta = chunk.choices[0].delta
+    return bool(delta.content or getattr(delta, 'reasoning_content', None))
+
+
+def _attempt(client, request, model, route, race, results, acquire):
+    """发出一次请求并读到首token为止；只有最先到达的一方把流交给调用者，其余的由 open_stream 关闭"""
+    with tracing.span("chat_attempt", model=model, route=route) as attempt_span:
+        stream = None
+        try:
+            for retry in range(RATE_LIMIT_RETRIES + 1):
+                if acquire:
+                    attempt_span["rate_wait"] = attempt_span.get("rate_wait", 0.0) + acquire()
+                if race["winner"] is not None:
+                    attempt_span["outcome"] = "cancelled"
+                    return
+                # 对冲计时从请求真正发出时开始，限速等待不计入
+                with race["lock"]:
+                    race["sent"].setdefault(route, time.monotonic())
+                start = time.perf_counter()
+                try:
+                    stream = client.chat.completions.create(**dict(request, model=model), stream=True)
+                    break
+                except Exception as e:
+                    if retry == RATE_LIMIT_RETRIES or getattr(e, 'status_code', None) not in (408, 429):
+                        raise
+                    attempt_span["retries"] = retry + 1
+                    time.sleep(_retry_delay(e, retry))
+            with race["lock"]:
+                race["streams"][route] = stream
+                lost = race["winner"] is not None
+            if lost:
+                _close(stream)
+                attempt_span["outcome"] = "cancelled"
+                return
+            head = []
+            for chunk in stream:
+                head.append(chunk)
+                if _has_token(chunk):
+                    record_ttft(model, time.perf_counter() - start)
+                    break
+            attempt_span["ttft"] = time.perf_counter() - start
+            with race["lock"]:
+                won = race["winner"] is None
+                if won:
+                    race["winner"] = route
+            if not won:
+                _close(stream)
+                attempt_span["outcome"] = "cancelled"
+                return
+            attempt_span["outcome"] = "won"
+            results.put((model, route, head, stream, None))
+        except Exception as e:
+            if stream is not None:
+                _close(stream)
+            if race["winner"] is not None:
+                # 另一方已胜出，本请求被关闭
+                attempt_span["outcome"] = "cancelled"
+                return
+            attempt_span["outcome"] = "error"
+            results.put((model, route, None, None, e))
+
+
+def open_stream(client, request, hedge_percentile=None, acquire=None, cancelled=None):
+    """发出流式请求，返回 (实际使用的模型, 路由, 已读取的首批chunk, 剩余的流)
+
+    路由为 primary、hedge 或 failover。hedge_percentile 为 None 时不对冲；
+    acquire 在每次发出请求前调用（限速）；cancelled() 为 True 时放弃所有请求。
+    """
+    primary = request["model"]
+    backup = MODEL_PAIRS.get(primary)
+    if backup:
+        # 由 429/408 的退避重试和故障转移代替客户端自带的重试
+        client = client.with_options(max_retries=0, timeout=STREAM_TIMEOUT)
+    race = {"winner": None, "lock": threading.Lock(), "sent": {}, "streams": {}}
+    results = queue.Queue()
+    routes = []
+
+    def settle(winner):
+        # 确定胜者后立即关闭其余请求，不必等它们的首token
+        with race["lock"]:
+            race["winner"] = race["winner"] or winner
+            losers = [stream for route, stream in race["streams"].items() if route != winner]
+        for stream in losers:
+            _close(stream)
+
+    def launch(model, route):
+        routes.append(route)
+        threading.Thread(target=tracing.bind(_attempt), name=f"chat-{route}", daemon=True,
+                         args=(client, request, model, route, race, results, acquire)).start()
+
+    launch(primary, "primary")
+    hedging_enabled = backup is not None and hedge_percentile is not None
+    delay = hedge_delay(primary, hedge_percentile) if hedging_enabled else None
+    pending = 1
+    while True:
+        if cancelled and cancelled():
+            settle("cancelled")
+            raise InterruptedError("生成已取消")
+        try:
+            model, route, head, stream, error = results.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            sent = race["sent"].get("primary")
+            if hedging_enabled and sent is not None and time.monotonic() >= sent + delay:
+                print(f"{primary} 超过 {delay:.1f}s 未返回首token，同时请求 {backup}")
+                launch(backup, "hedge")
+                pending += 1
+                hedging_enabled = False
+            continue
+        pending -= 1
+        if error is None:
+            settle(route)
+            return model, route, head, stream
+        if backup and len(routes) == 1 and is_retryable(error):
+            print(f"{model} 请求失败（{type(error).__name__} {getattr(error, 'status_code', '')}），切换到 {backup}")
+            launch(backup, "failover")
+            pending += 1
+            hedging_enabled = False
+            continue
+        if pending == 0:
+            raise error
@@ -0,0 +1,116 @@
+"""上传图片的内容寻址存储
+
+图片按 SHA-256 存放在 IMAGE_DIR 中，相同内容只保存一次；消息中只记录图片ID（"<sha256>.<ext>"）。
+只有在构造 VLM 请求时才编码为 data URL，并用有界 LRU 缓存编码结果。
+上传的图片可先缩放、重新编码（prepare_image），结果按原图哈希和参数缓存。
+"""
+import base64
+import hashlib
+import io
+import os
+from functools import lru_cache
+
+IMAGE_DIR = os.path.join("ChatHistory", "images")
+PREPARED_DIR = os.path.join(IMAGE_DIR, "prepared")  # 原图哈希 -> 预处理后图片ID
+DATA_URL_CACHE_SIZE = 16   # 缓存的 data URL 数量
+IMAGE_MAX_EDGE = 1536      # 预处理后的最大边长，0 表示不缩放
+IMAGE_QUALITY = 85         # JPEG 质量
+
+MIME_TO_EXT = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/jpg": "jpg",
+    "image/webp": "webp",
+    "image/gif": "gif",
+}
+EXT_TO_MIME = {"png": "image/png", "jpg": "image/jpeg", "webp": "image/webp", "gif": "image/gif"}
+
+
+def image_path(image_id):
+    return os.path.join(IMAGE_DIR, image_id)
+
+
+def image_mime(image_id):
+    return EXT_TO_MIME.get(image_id.rsplit(".", 1)[-1], "image/png")
+
+
+def put_image(data, mime_type):
+    """保存图片并返回图片ID；内容已存在时直接复用"""
+    image_id = f"{hashlib.sha256(data).hexdigest()}.{MIME_TO_EXT.get(mime_type, 'png')}"
+    path = image_path(image_id)
+    if not os.path.exists(path):
+        os.makedirs(IMAGE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return image_id
+
+
+def read_image(image_id):
+    with open(image_path(image_id), "rb") as f:
+        return f.read()
+
+
+@lru_cache(maxsize=DATA_URL_CACHE_SIZE)
+def data_url(image_id):
+    """把图片编码为 data URL（仅在发送给 VLM 时调用）"""
+    encoded = base64.b64encode(read_image(image_id)).decode("utf-8")
+    return f"data:{image_mime(image_id)};base64,{encoded}"
+
+
+def _encode(data, max_edge, quality):
+    """解码、按需缩放并重新编码为JPEG，返回 (bytes, mime, 是否缩小了尺寸)"""
+    from PIL import Image, ImageOps  # 只在上传图片时才需要
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        resized = bool(max_edge) and max(image.size) > max_edge
+        if resized:
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if image.mode in ("RGBA", "LA", "P"):
+            # JPEG不支持透明通道，铺白色背景
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+        return output.getvalue(), "image/jpeg", resized
+
+
+def prepare_image(data, mime_type, max_edge=IMAGE_MAX_EDGE, quality=IMAGE_QUALITY):
+    """预处理上传的图片并保存，返回 (image_id, 原始字节数, 处理后字节数)
+
+    结果按原图哈希和参数缓存；未缩放且重新编码后反而更大（如小截图）时保留原图，
+    缩放过的图片总是使用处理后的结果，以保证不超过最大边长。
+    """
+    key = f"{hashlib.sha256(data).hexdigest()}_{max_edge}_{quality}"
+    cache_path = os.path.join(PREPARED_DIR, key)
+    if os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as f:
+            image_id = f.read().strip()
+        if os.path.exists(image_path(image_id)):
+            return image_id, len(data), os.path.getsize(image_path(image_id))
+
+    try:
+        encoded, encoded_mime, resized = _encode(data, max_edge, quality)
+    except Exception as e:
+        print(f"图片预处理失败，使用原图: {str(e)}")
+        encoded, encoded_mime, resized = data, mime_type, False
+    if not resized and len(encoded) >= len(data):
+        encoded, encoded_mime = data, mime_type
+    image_id = put_image(encoded, encoded_mime)
+
+    os.makedirs(PREPARED_DIR, exist_ok=True)
+    with open(cache_path, "w", encoding="utf-8") as f:
+        f.write(image_id)
+    return image_id, len(data), len(encoded)
+
+
+def format_size(num_bytes):
+    for unit in ("B", "KB", "MB"):
+        if num_bytes < 1024 or unit == "MB":
+            return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
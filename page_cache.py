@@ -0,0 +1,173 @@
+"""网页内容的本地持久化缓存（SQLite）
+
+原始html与提取后的正文分表存放，键为规范化后的URL。
+- 未过期（TTL内）的页面直接返回，不访问网络
+- 过期页面携带 ETag / Last-Modified 发起条件请求，304时沿用缓存
+- 缓存总大小超过上限时按最近访问时间（LRU）淘汰
+"""
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+CACHE_DIR = "WebCache"
+CACHE_FILE = os.path.join(CACHE_DIR, "pages.db")
+CACHE_TTL = 24 * 3600                 # 页面新鲜期（秒）
+MAX_CACHE_BYTES = 200 * 1024 * 1024   # 缓存总大小上限
+
+# 规范化时去除的追踪参数
+TRACKING_PREFIXES = ('utm_',)
+TRACKING_PARAMS = {'spm', 'fbclid', 'gclid'}
+
+_local = threading.local()
+_evict_lock = threading.Lock()
+
+
+def normalize_url(url):
+    """规范化URL：小写协议与域名、去掉默认端口、片段和追踪参数、对查询参数排序"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme == 'http' and netloc.endswith(':80')) or (scheme == 'https' and netloc.endswith(':443')):
+        netloc = netloc.rsplit(':', 1)[0]
+    path = parts.path or '/'
+    if len(path) > 1 and path.endswith('/'):
+        path = path.rstrip('/')
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith(TRACKING_PREFIXES) and k.lower() not in TRACKING_PARAMS
+    )
+    return urlunsplit((scheme, netloc, path, urlencode(query), ''))
+
+
+def _connect():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        conn = sqlite3.connect(CACHE_FILE, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                html TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            )""")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS texts (
+                url TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                size INTEGER NOT NULL
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_accessed ON pages(accessed_at)")
+        conn.commit()
+        _local.conn = conn
+    return conn
+
+
+def get_page(url):
+    """读取缓存页面，返回 {'html', 'etag', 'last_modified', 'fresh'}；未命中返回None"""
+    key = normalize_url(url)
+    conn = _connect()
+    row = conn.execute(
+        "SELECT html, etag, last_modified, fetched_at FROM pages WHERE url = ?", (key,)
+    ).fetchone()
+    if row is None:
+        return None
+    now = time.time()
+    conn.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (now, key))
+    conn.commit()
+    return {
+        'html': row[0],
+        'etag': row[1],
+        'last_modified': row[2],
+        'fresh': now - row[3] < CACHE_TTL
+    }
+
+
+def conditional_headers(cached):
+    """根据缓存的校验信息生成条件请求头"""
+    headers = {}
+    if cached and cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+    if cached and cached.get('last_modified'):
+        headers['If-Modified-Since'] = cached['last_modified']
+    return headers
+
+
+def touch_page(url):
+    """服务器返回304时刷新页面的新鲜期"""
+    key = normalize_url(url)
+    now = time.time()
+    conn = _connect()
+    conn.execute("UPDATE pages SET fetched_at = ?, accessed_at = ? WHERE url = ?", (now, now, key))
+    conn.commit()
+
+
+def put_page(url, html, etag=None, last_modified=None):
+    """写入页面；内容变化时同时作废已提取的正文"""
+    key = normalize_url(url)
+    now = time.time()
+    conn = _connect()
+    row = conn.execute("SELECT html FROM pages WHERE url = ?", (key,)).fetchone()
+    if row is not None and row[0] != html:
+        conn.execute("DELETE FROM texts WHERE url = ?", (key,))
+    conn.execute(
+        "INSERT OR REPLACE INTO pages (url, html, etag, last_modified, fetched_at, accessed_at, size) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (key, html, etag, last_modified, now, now, len(html.encode('utf-8')))
+    )
+    conn.commit()
+    evict()
+
+
+def get_text(url):
+    """读取已提取的正文，未命中返回None"""
+    row = _connect().execute(
+        "SELECT text FROM texts WHERE url = ?", (normalize_url(url),)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def put_text(url, text):
+    conn = _connect()
+    conn.execute(
+        "INSERT OR REPLACE INTO texts (url, text, size) VALUES (?, ?, ?)",
+        (normalize_url(url), text, len(text.encode('utf-8')))
+    )
+    conn.commit()
+
+
+def evict(max_bytes=None):
+    """总大小超过上限时按最近访问时间淘汰页面及其正文"""
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    with _evict_lock:
+        conn = _connect()
+        total = conn.execute(
+            "SELECT COALESCE((SELECT SUM(size) FROM pages), 0) + COALESCE((SELECT SUM(size) FROM texts), 0)"
+        ).fetchone()[0]
+        if total <= max_bytes:
+            return
+        rows = conn.execute(
+            "SELECT p.url, p.size + COALESCE(t.size, 0) FROM pages p "
+            "LEFT JOIN texts t ON t.url = p.url ORDER BY p.accessed_at"
+        ).fetchall()
+        for url, size in rows:
+            if total <= max_bytes:
+                break
+            conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+            conn.execute("DELETE FROM texts WHERE url = ?", (url,))
+            total -= size
+        conn.commit()
+
+
+def clear():
+    conn = _connect()
+    conn.execute("DELETE FROM pages")
+    conn.execute("DELETE FROM texts")
+    conn.commit()
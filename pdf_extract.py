@@ -1,9 +1,21 @@
 import os
+import argparse
+import hashlib
+import io
+import json
+import mmap
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pypdf import PdfReader
 from pdfminer.high_level import extract_text
 import pandas as pd
 import re
 
+PAGES_PER_TASK = 8  # Pages handled by one process-pool task
+MANIFEST_FILE = ".manifest.json"  # Content hashes of processed PDFs, kept in the output folder
+
 # Function to check if a PDF contains selectable text
 def is_text_pdf(pdf_path):
     reader = PdfReader(pdf_path)
@@ -15,64 +27,328 @@ def is_text_pdf(pdf_path):
 # Function to extract text (from normal PDFs)
 def extract_text_pypdf(pdf_path):
     reader = PdfReader(pdf_path)
-    return "\n".join(page.extract_text() for page in reader.pages if page.extract_text())
+    return "\n".join(text for text in (page.extract_text() for page in reader.pages) if text)
 
 # Function to extract text (preserving layout)
 def extract_text_pdfminer(pdf_path):
     return extract_text(pdf_path)
 
+# Worker: extract pages [start, end) of one PDF, one extract_text call per page
+def extract_page_range(pdf_path, start, end, method="pypdf"):
+    if method == "pdfminer":
+        # pdfminer ends every page with a form feed
+        text = extract_text(pdf_path, page_numbers=range(start, end))
+        pages = text.split("\f")[:end - start]
+        return pages + [""] * (end - start - len(pages))
+    reader = PdfReader(pdf_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+# Generator yielding page texts in order, extracted in parallel by a process pool
+def iter_page_texts(pdf_path, method="pypdf", max_workers=None, pages_per_task=PAGES_PER_TASK):
+    num_pages = len(PdfReader(pdf_path).pages)
+    max_workers = max_workers or os.cpu_count() or 1
+    if num_pages <= pages_per_task or max_workers == 1:
+        yield from extract_page_range(pdf_path, 0, num_pages, method)
+        return
+
+    pool = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        futures = [
+            pool.submit(extract_page_range, pdf_path, start, min(start + pages_per_task, num_pages), method)
+            for start in range(0, num_pages, pages_per_task)
+        ]
+        for future in futures:
+            yield from future.result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+# Function to extract text page-parallel and join pages in order
+def extract_text_parallel(pdf_path, method="pypdf", max_workers=None):
+    return "\n".join(text for text in iter_page_texts(pdf_path, method, max_workers) if text)
+
+# Common header/footer patterns, compiled once
+HEADER_FOOTER_PATTERN = re.compile('|'.join([
+    r'^Page \d+ of \d+$',          # Page numbers
+    r'\d{1,2} [A-Za-z]{3} \d{4}',  # Dates like 31 Mar 2025
+    r'https?://\S+',                # URLs
+    r'All use subject to \S+',      # JSTOR footer
+    r'This content downloaded from',# Download notice
+    r'^\d+$'                        # Standalone page numbers
+]), flags=re.IGNORECASE | re.MULTILINE)
+DIGITS = re.compile(r'\d+')
+# Running heads/feet carrying a page number at either end: "12", "Page 3 of 9", "Journal 12", "- 4 -", "第 5 页"
+PAGE_NUMBER_LINE = re.compile(
+    r'^(?:\D*\s)?(?:page\s+|p\.\s*|第\s*)?[-–(]?\s*\d{1,4}(?:\s*(?:/|of)\s*\d{1,4})?\s*(?:页|[-–)])?$'
+    r'|^[-–(]?\d{1,4}[-–)]?\s\D*$', flags=re.IGNORECASE)
+
+EDGE_LINES = 3       # Lines at the top/bottom of a page checked for repeated headers/footers
+WARMUP_PAGES = 8     # Pages buffered before repeated-line statistics are trusted
+REPEAT_RATIO = 0.6   # Share of pages a line must appear on (same position) to count as boilerplate
+
+def filter_lines(lines):
+    """Lazily drop lines matching the common header/footer patterns"""
+    return (line for line in lines if not HEADER_FOOTER_PATTERN.search(line))
+
 def filter_headers_footers(text):
     """Remove common header/footer patterns using regex"""
-    patterns = [
-        r'^Page \d+ of \d+$',          # Page numbers
-        r'\d{1,2} [A-Za-z]{3} \d{4}',  # Dates like 31 Mar 2025
-        r'https?://\S+',                # URLs
-        r'All use subject to \S+',      # JSTOR footer
-        r'This content downloaded from',# Download notice
-        r'^\d+$'                        # Standalone page numbers
-    ]
-    combined_pattern = re.compile('|'.join(patterns), flags=re.IGNORECASE | re.MULTILINE)
-    return '\n'.join([line for line in text.split('\n') if not combined_pattern.search(line)])
+    return ''.join(filter_lines(io.StringIO(text)))
+
+# Comparison text of an edge line; only page-number lines are digit-masked so "Page 3" matches "Page 4"
+def edge_text(line):
+    line = line.strip()
+    return DIGITS.sub('#', line) if PAGE_NUMBER_LINE.match(line) else line
+
+# Position keys of the non-blank edge lines of a page
+def edge_keys(lines, edge_lines):
+    positions = [i for i, line in enumerate(lines) if line.strip()]
+    keys = {}
+    for rank, i in enumerate(positions[:edge_lines]):
+        keys.setdefault(i, []).append(('head', rank, edge_text(lines[i])))
+    for rank, i in enumerate(reversed(positions[-edge_lines:])):
+        keys.setdefault(i, []).append(('foot', rank, edge_text(lines[i])))
+    return keys
+
+def filter_pages(pages, edge_lines=EDGE_LINES, warmup=WARMUP_PAGES, min_ratio=REPEAT_RATIO):
+    """Streaming header/footer filter over a page generator
+
+    Besides the fixed patterns, lines that recur at the same position (top or bottom)
+    on most pages are dropped. Only the first `warmup` pages are buffered while the
+    statistics build up; later pages are filtered as they arrive.
+    """
+    counts = Counter()
+    seen = 0
+    buffer = []
+
+    def clean(lines, keys):
+        threshold = max(2, min_ratio * seen)
+        for i, line in enumerate(lines):
+            if any(counts[key] >= threshold for key in keys.get(i, ())):
+                continue
+            if not HEADER_FOOTER_PATTERN.search(line):
+                yield line
+
+    for page in pages:
+        lines = page.split('\n')
+        keys = edge_keys(lines, edge_lines)
+        counts.update(key for page_keys in keys.values() for key in page_keys)
+        seen += 1
+        if seen < warmup:
+            buffer.append((lines, keys))
+            continue
+        for buffered in buffer:
+            yield '\n'.join(clean(*buffered))
+        buffer.clear()
+        yield '\n'.join(clean(lines, keys))
+    for buffered in buffer:
+        yield '\n'.join(clean(*buffered))
 
 # Function to extract metadata
 def extract_metadata(pdf_path):
     reader = PdfReader(pdf_path)
     return reader.metadata  # Returns dictionary
 
+# PDF opened once (memory-mapped) that lazily serves detection, page text and metadata
+class PdfDocument:
+    def __init__(self, pdf_path):
+        self.path = pdf_path
+        self._file = open(pdf_path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.reader = PdfReader(self._mmap)
+        self._texts = {}
+        self._is_text = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.reader = None
+        self._mmap.close()
+        self._file.close()
+
+    def __len__(self):
+        return len(self.reader.pages)
+
+    @property
+    def size(self):
+        return len(self._mmap)
+
+    @property
+    def metadata(self):
+        return self.reader.metadata
+
+    # Text of one page via pypdf, cached so detection work is not repeated
+    def page_text(self, index):
+        if index not in self._texts:
+            self._texts[index] = self.reader.pages[index].extract_text() or ""
+        return self._texts[index]
+
+    # Check if the PDF contains selectable text (stops at the first page with text)
+    @property
+    def is_text(self):
+        if self._is_text is None:
+            self._is_text = any(self.page_text(i) for i in range(len(self)))
+        return self._is_text
+
+    # Page texts in order: pypdf by default, pdfminer when layout fidelity is requested
+    def iter_pages(self, layout=False, max_workers=None):
+        method = "pdfminer" if layout else "pypdf"
+        max_workers = max_workers or os.cpu_count() or 1
+        if max_workers > 1 and len(self) > PAGES_PER_TASK:
+            yield from iter_page_texts(self.path, method, max_workers)
+        elif layout:
+            self._file.seek(0)
+            yield from extract_text(self._file).split("\f")[:len(self)]
+        else:
+            for i in range(len(self)):
+                yield self.page_text(i)
+
+# Write a file atomically: temp file in the same folder, then rename over the target
+def write_atomic(path, data):
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+# SHA-256 of a file, read in chunks
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 # Function to process PDF and extract all data
-def process_pdf(pdf_path):
+def process_pdf(pdf_path, layout=False, output_path=None, max_workers=None, clean=False):
     print(f"\n📄 Processing PDF: {pdf_path}")
 
-    # Step 1: Detect if the PDF contains selectable text
-    text_pdf = is_text_pdf(pdf_path)
+    with PdfDocument(pdf_path) as doc:
+        # Step 1: Detect if the PDF contains selectable text
+        if not doc.is_text:
+            print("⚠️ No selectable text found (likely a scanned PDF), skipping.")
+            return None
 
-    # Step 2: Extract text (choose method)
-    print("✅ Text detected: Extracting with pypdf...")
-    text = extract_text_pdfminer(pdf_path)
+        # Step 2: Extract text (choose method)
+        if layout:
+            print("✅ Text detected: Extracting with pdfminer (layout)...")
+        else:
+            print("✅ Text detected: Extracting with pypdf...")
+        pages = doc.iter_pages(layout, max_workers)
+        if clean:
+            pages = filter_pages(pages)
+        text = "\n".join(page for page in pages if page)
 
-    # Step 4: Extract metadata
-    print("📝 Extracting metadata...")
-    metadata = extract_metadata(pdf_path)
+        # Step 4: Extract metadata
+        print("📝 Extracting metadata...")
+        metadata = doc.metadata
+        stats = {"pages": len(doc), "bytes": doc.size}
 
     # Step 5: Save results
-    output_folder = "output"
-    os.makedirs(output_folder, exist_ok=True)
+    if output_path is None:
+        output_path = f"output/{os.path.basename(pdf_path).split('.')[0]}.txt"
+    write_atomic(output_path, text)
+
+    #write_atomic(f"{os.path.splitext(output_path)[0]}_metadata.txt", str(metadata))
+
+    print(f"\n✅ PDF Processing Complete! Results saved to '{output_path}'.")
+    return stats
+
+# Check whether a manifest entry's output is still in place (scanned PDFs have none)
+def is_up_to_date(entry, output_path):
+    return entry.get("no_text", False) or os.path.exists(output_path)
+
+# Worker for batch mode: skip the file if its content hash is unchanged
+def process_batch_item(pdf_path, output_path, layout, clean, entry):
+    digest = file_hash(pdf_path)
+    if entry and digest == entry["hash"] and is_up_to_date(entry, output_path):
+        return {"hash": digest, "skipped": True, "no_text": entry.get("no_text", False)}
+    # One process per file already, so no nested page-level pool
+    stats = process_pdf(pdf_path, layout, output_path, max_workers=1, clean=clean)
+    return {"hash": digest, "skipped": False, "no_text": stats is None, **(stats or {"pages": 0, "bytes": 0})}
 
-    with open(f"{output_folder}/{os.path.basename(pdf_path).split('.')[0]}.txt", "w", encoding="utf-8") as f:
-        f.write(text)
+def load_manifest(output_folder):
+    path = os.path.join(output_folder, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
 
-    #with open(f"{output_folder}/{os.path.basename(pdf_path).split('.')[0]}_metadata.txt", "w", encoding="utf-8") as f:
-    #    f.write(str(metadata))
+# Process every PDF under a directory tree, re-extracting only new or changed files
+def process_directory(directory, output_folder="output", layout=False, max_workers=None, force=False, clean=False):
+    manifest = {} if force else load_manifest(output_folder)
+    jobs = {}
+    for root, _, files in os.walk(directory):
+        for filename in files:
+            if not filename.lower().endswith(".pdf"):
+                continue
+            pdf_path = os.path.join(root, filename)
+            rel_path = os.path.relpath(pdf_path, directory)
+            output_path = os.path.join(output_folder, os.path.splitext(rel_path)[0] + ".txt")
+            stat = os.stat(pdf_path)
+            entry = manifest.get(rel_path)
+            # Same size and mtime: unchanged without hashing
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime \
+                    and is_up_to_date(entry, output_path):
+                continue
+            jobs[rel_path] = (pdf_path, output_path, stat, entry)
 
-    print(f"\n✅ PDF Processing Complete! Results saved in '{output_folder}' folder.")
+    print(f"🔎 {len(jobs)} new or modified PDF(s) to check, {len(manifest)} in manifest.")
+    start = time.perf_counter()
+    total_pages, total_bytes, processed, skipped, failed = 0, 0, 0, 0, 0
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(process_batch_item, pdf_path, output_path, layout, clean, entry): rel_path
+                for rel_path, (pdf_path, output_path, _, entry) in jobs.items()
+            }
+            for future in as_completed(futures):
+                rel_path = futures[future]
+                stat = jobs[rel_path][2]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"❌ Failed: {rel_path}: {e}")
+                    failed += 1
+                    continue
+                manifest[rel_path] = {"hash": result["hash"], "size": stat.st_size, "mtime": stat.st_mtime}
+                if result["no_text"]:
+                    # No output file is written for scanned PDFs; remember that so they aren't re-parsed
+                    manifest[rel_path]["no_text"] = True
+                if result["skipped"]:
+                    skipped += 1
+                else:
+                    processed += 1
+                    total_pages += result["pages"]
+                    total_bytes += result["bytes"]
+    finally:
+        write_atomic(os.path.join(output_folder, MANIFEST_FILE), json.dumps(manifest, ensure_ascii=False, indent=2))
+
+    elapsed = time.perf_counter() - start
+    print(f"\n✅ Batch complete: {processed} processed, {skipped} unchanged, {failed} failed in {elapsed:.1f}s")
+    if elapsed > 0 and processed:
+        print(f"⚡ Throughput: {total_pages / elapsed:.1f} pages/s, {total_bytes / elapsed / 1e6:.2f} MB/s")
 
 # Run script
 if __name__ == "__main__":
-    """
-    directory = ""
-    for filename in os.listdir(directory):
-        if filename.lower().endswith('.pdf'):
-            process_pdf(os.path.join(directory,filename))
-    """
-    filename = "E:/Downloads/t2.pdf"
-    process_pdf(filename)
+    parser = argparse.ArgumentParser(description="Extract plain text from a PDF file or a directory tree of PDFs.")
+    parser.add_argument("path", help="PDF file or directory")
+    parser.add_argument("-o", "--output", default="output", help="output folder (default: output)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--layout", action="store_true", help="use pdfminer to preserve layout")
+    parser.add_argument("--clean", action="store_true", help="remove headers, footers and page numbers")
+    parser.add_argument("--force", action="store_true", help="ignore the manifest and re-process everything")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.path):
+        process_directory(args.path, args.output, args.layout, args.workers, args.force, args.clean)
+    else:
+        name = os.path.splitext(os.path.basename(args.path))[0]
+        process_pdf(args.path, args.layout, os.path.join(args.output, name + ".txt"), args.workers, args.clean)
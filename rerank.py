@@ -0,0 +1,145 @@
+"""参考资料的本地去重与相关度排序（纯CPU，无额外依赖）
+
+1. 用 SimHash 去掉近似重复的页面（镜像、转载）
+2. 把每个页面切成段落，用 BM25 对提问打分，并去掉近似重复的段落
+3. 在总字数预算内保留得分最高的段落，按原文顺序拼回各自的来源
+"""
+import hashlib
+import math
+import re
+from collections import Counter
+
+PASSAGE_CHARS = 400          # 段落的目标长度
+REFERENCE_CHAR_BUDGET = 8000 # 所有参考资料保留的总字数
+MIN_PASSAGE_CHARS = 20       # 过短的段落（导航、按钮文字）直接丢弃
+SIMHASH_DISTANCE = 3         # 汉明距离不超过该值视为近似重复
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+WORDS = re.compile(r'[a-z0-9]+|[\u3400-\u4dbf\u4e00-\u9fff]+')
+SENTENCE_END = re.compile(r'(?<=[。！？!?；;])|(?<=\. )')
+
+
+def tokenize(text):
+    """英文按单词，中文按相邻二字切分"""
+    tokens = []
+    for run in WORDS.findall(text.lower()):
+        if run[0].isascii():
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def simhash(tokens):
+    weights = [0] * 64
+    for token, count in Counter(tokens).items():
+        value = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(64):
+            weights[bit] += count if value >> bit & 1 else -count
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def is_near_duplicate(fingerprint, fingerprints):
+    return any(bin(fingerprint ^ other).count('1') <= SIMHASH_DISTANCE for other in fingerprints)
+
+
+def split_passages(text, size=PASSAGE_CHARS):
+    """按段落切分，短段落合并，长段落在句末断开"""
+    passages = []
+    current = ""
+    for paragraph in re.split(r'\n\s*\n|\n', text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        pieces = [paragraph]
+        if len(paragraph) > size:
+            pieces = []
+            piece = ""
+            for sentence in SENTENCE_END.split(paragraph):
+                if piece and len(piece) + len(sentence) > size:
+                    pieces.append(piece)
+                    piece = ""
+                piece += sentence
+            if piece:
+                pieces.append(piece)
+        for piece in pieces:
+            if current and len(current) + len(piece) > size:
+                passages.append(current)
+                current = ""
+            current = f"{current}\n{piece}" if current else piece
+    if current:
+        passages.append(current)
+    return [p for p in passages if len(p) >= MIN_PASSAGE_CHARS]
+
+
+def bm25_scores(query_tokens, documents):
+    """documents 为分词后的段落列表"""
+    if not documents:
+        return []
+    avg_len = sum(len(doc) for doc in documents) / len(documents) or 1
+    df = Counter(token for doc in documents for token in set(doc))
+    n = len(documents)
+    query_terms = set(query_tokens)
+    scores = []
+    for doc in documents:
+        tf = Counter(doc)
+        score = 0.0
+        for term in query_terms:
+            if term not in tf:
+                continue
+            idf = math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5))
+            score += idf * tf[term] * (BM25_K1 + 1) / (
+                tf[term] + BM25_K1 * (1 - BM25_B + BM25_B * len(doc) / avg_len))
+        scores.append(score)
+    return scores
+
+
+def rank_references(query, references, budget=REFERENCE_CHAR_BUDGET):
+    """去重并按相关度筛选参考资料，返回内容被替换为精选段落的参考资料列表"""
+    # 1. 页面级去重
+    pages = []
+    fingerprints = []
+    for ref in references:
+        fingerprint = simhash(tokenize(ref.get('content', '')))
+        if is_near_duplicate(fingerprint, fingerprints):
+            continue
+        fingerprints.append(fingerprint)
+        pages.append(ref)
+
+    # 2. 段落切分与打分
+    passages = []  # (页面序号, 段落序号, 文本, 分词)
+    for page_index, ref in enumerate(pages):
+        for passage_index, text in enumerate(split_passages(ref.get('content', ''))):
+            passages.append((page_index, passage_index, text, tokenize(text)))
+    scores = bm25_scores(tokenize(query), [p[3] for p in passages])
+
+    # 3. 按得分选取段落，跳过近似重复，直到用完预算
+    selected = {}
+    used = 0
+    passage_fingerprints = []
+    order = sorted(range(len(passages)), key=lambda i: (-scores[i], passages[i][0], passages[i][1]))
+    # 与提问无关的段落不保留；全部无关时退化为按原顺序取开头
+    if any(scores):
+        order = [i for i in order if scores[i] > 0]
+    for i in order:
+        page_index, passage_index, text, tokens = passages[i]
+        if used + len(text) > budget:
+            continue
+        fingerprint = simhash(tokens)
+        if is_near_duplicate(fingerprint, passage_fingerprints):
+            continue
+        passage_fingerprints.append(fingerprint)
+        selected.setdefault(page_index, []).append((passage_index, text, scores[i]))
+        used += len(text)
+
+    # 4. 按最佳段落得分排列来源，段落保持原文顺序
+    ranked = []
+    for page_index, items in selected.items():
+        ref = dict(pages[page_index])
+        ref['content'] = "\n……\n".join(text for _, text, _ in sorted(items))
+        ref['score'] = max(score for _, _, score in items)
+        ranked.append((-ref['score'], page_index, ref))
+    return [ref for _, _, ref in sorted(ranked, key=lambda item: item[:2])]
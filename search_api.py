@@ -1,36 +1,223 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
 import re
-from langchain_community.tools import DuckDuckGoSearchResults
-from newspaper import Article
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FuturesTimeout
+from urllib.parse import urlparse
 import xml.etree.ElementTree as ET
 import io
-from pypdf import PdfReader
+import page_cache
+import rerank
+import tracing
 
-# 配置请求头模拟浏览器访问
+# 配置请求头模拟浏览器访问（安装brotli后自动接受br压缩）
 HEADERS = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3',
+    'Accept-Encoding': ACCEPT_ENCODING
 }
 
+# 连接池与重试配置
+TIMEOUT = (5, 15)       # (连接超时, 读取超时) 秒
+MAX_RETRIES = 3         # 临时性错误的最大重试次数
+RETRY_BACKOFF = 0.5     # 指数退避基数：0.5s, 1s, 2s ...
+POOL_HOSTS = 32         # 连接池缓存的站点数
+
+# 下载限制
+MAX_PAGE_BYTES = 2 * 1024 * 1024    # 网页正文上限，超出部分截断
+MAX_PDF_BYTES = 20 * 1024 * 1024    # PDF上限，超出则放弃下载
+DOWNLOAD_DEADLINE = 20              # 单次下载的总时限（秒）
+CHUNK_SIZE = 64 * 1024
+
+# 首块内容的魔数，用于识别伪装成网页的二进制文件
+MAGIC_NUMBERS = {
+    b'%PDF': 'pdf',
+    b'\x89PNG': 'binary',
+    b'\xff\xd8\xff': 'binary',
+    b'GIF8': 'binary',
+    b'PK\x03\x04': 'binary',
+    b'\x1f\x8b': 'binary',
+    b'Rar!': 'binary',
+    b'\x7fELF': 'binary',
+    b'MZ': 'binary',
+}
+
+# arXiv Atom feed 的命名空间
+ARXIV_NS = {'atom': 'http://www.w3.org/2005/Atom', 'arxiv': 'http://arxiv.org/schemas/atom'}
+ATOM = '{http://www.w3.org/2005/Atom}'
+# 新式编号如 2501.12948，旧式编号如 hep-th/9901001
+ARXIV_ID_PATTERN = re.compile(r'arxiv\.org/(?:abs|pdf|html)/(\d{4}\.\d{4,5}|[a-z\-]+(?:\.[A-Z]{2})?/\d{7})(?:v\d+)?', re.IGNORECASE)
+
+# 并发抓取配置
+MAX_WORKERS = 8         # 线程池大小
+PER_HOST_LIMIT = 2      # 同一站点的最大并发数
+SEARCH_DEADLINE = 20    # 抓取阶段的总时限（秒），超时的页面直接丢弃
+TURN_DEADLINE = 25      # 一轮对话中搜索的总时限（秒），超时后用已完成的结果继续
+MAX_KEYWORDS = 3        # 并行搜索的关键词数
+MAX_REFERENCES = 12     # 合并后保留的参考资料数
+
+_host_semaphores = {}
+_host_lock = threading.Lock()
+_session = None
+_session_lock = threading.Lock()
+_search_tool = None
+
+def get_session():
+    """获取模块共享的HTTP会话（连接复用、自动重试）"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=MAX_RETRIES,
+                connect=MAX_RETRIES,
+                read=MAX_RETRIES,
+                backoff_factor=RETRY_BACKOFF,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(['GET', 'HEAD']),
+                respect_retry_after_header=True,
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(
+                pool_connections=POOL_HOSTS,
+                pool_maxsize=PER_HOST_LIMIT,
+                pool_block=True,
+                max_retries=retry
+            )
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+def get_search_tool():
+    """获取模块共享的搜索工具；langchain 较重，首次使用时才导入"""
+    global _search_tool
+    with _session_lock:
+        if _search_tool is None:
+            from langchain_community.tools import DuckDuckGoSearchResults
+            _search_tool = DuckDuckGoSearchResults(output_format='list')
+        return _search_tool
+
+class UnsupportedContent(Exception):
+    """下载内容类型不受支持"""
+
+def media_kind(content_type):
+    """根据Content-Type判断内容类别：text / pdf / binary，无法判断时返回None"""
+    mime = content_type.split(';')[0].strip().lower()
+    if not mime:
+        return None
+    if mime.startswith('text/') or mime.endswith(('+xml', '/xml', '/json', '/xhtml')):
+        return 'text'
+    if mime == 'application/pdf':
+        return 'pdf'
+    if mime in ('application/octet-stream', 'binary/octet-stream'):
+        return None
+    return 'binary'
+
+def sniff_kind(chunk):
+    """根据首块内容嗅探类别"""
+    for magic, kind in MAGIC_NUMBERS.items():
+        if chunk.startswith(magic):
+            return kind
+    if b'\x00' in chunk[:1024]:
+        return 'binary'
+    return 'text'
+
+def decode_body(body, response):
+    """按响应头或html中的meta声明解码，默认utf-8"""
+    encoding = None
+    if 'charset=' in response.headers.get('Content-Type', '').lower():
+        encoding = response.encoding
+    if not encoding:
+        match = re.search(rb'<meta[^>]+charset=["\']?([\w-]+)', body[:4096], re.IGNORECASE)
+        if match:
+            encoding = match.group(1).decode('ascii')
+    try:
+        return body.decode(encoding or 'utf-8', errors='replace')
+    except LookupError:
+        return body.decode('utf-8', errors='replace')
+
+def stream_download(url, accept=('text',), max_bytes=MAX_PAGE_BYTES, truncate=True, headers=None):
+    """流式下载，首块嗅探内容类型，超出上限时截断（truncate=False时放弃）
+
+    返回 (response, body)；非2xx响应的body为None，类型不符或超限时抛出UnsupportedContent
+    """
+    deadline = time.monotonic() + DOWNLOAD_DEADLINE
+    with get_session().get(url, headers=headers, timeout=TIMEOUT, stream=True) as response:
+        if response.status_code >= 300:
+            return response, None
+        kind = media_kind(response.headers.get('Content-Type', ''))
+        if kind is not None and kind not in accept:
+            raise UnsupportedContent(f"不支持的内容类型 {response.headers.get('Content-Type')}")
+        length = response.headers.get('Content-Length')
+        if not truncate and length and length.isdigit() and int(length) > max_bytes:
+            raise UnsupportedContent(f"内容过大 {length} 字节")
+
+        body = bytearray()
+        for chunk in response.iter_content(CHUNK_SIZE):
+            if not body:
+                kind = sniff_kind(chunk)
+                if kind not in accept:
+                    raise UnsupportedContent(f"内容类型嗅探为 {kind}")
+            body += chunk
+            if len(body) >= max_bytes:
+                if not truncate:
+                    raise UnsupportedContent(f"内容超过 {max_bytes} 字节")
+                del body[max_bytes:]
+                print(f"内容超过 {max_bytes} 字节，已截断: {url}")
+                break
+            if time.monotonic() > deadline:
+                print(f"下载超过 {DOWNLOAD_DEADLINE}s，已截断: {url}")
+                break
+        return response, bytes(body)
+
+def arxiv_id(url):
+    """从arXiv链接（abs/pdf/html）中提取论文编号，去掉版本号"""
+    match = ARXIV_ID_PATTERN.search(url)
+    return match.group(1) if match else None
+
+def parse_arxiv_entries(xml_data):
+    """用iterparse增量解析arXiv Atom feed，逐条返回论文信息"""
+    if isinstance(xml_data, str):
+        xml_data = xml_data.encode('utf-8')
+    for _, elem in ET.iterparse(io.BytesIO(xml_data), events=('end',)):
+        if elem.tag != ATOM + 'entry':
+            continue
+        pdf_link = None
+        for link in elem.findall('atom:link', ARXIV_NS):
+            if link.attrib.get('title') == 'pdf':
+                pdf_link = link.attrib['href']
+        yield {
+            'id': arxiv_id(elem.findtext('atom:id', '', ARXIV_NS)),
+            'title': elem.findtext('atom:title', '', ARXIV_NS).strip(),
+            'summary': elem.findtext('atom:summary', '', ARXIV_NS).strip(),
+            'published': elem.findtext('atom:published', '', ARXIV_NS),
+            'authors': [author.findtext('atom:name', '', ARXIV_NS) for author in elem.findall('atom:author', ARXIV_NS)],
+            'pdf_link': pdf_link,
+            # 单篇论文的feed，用于按链接缓存
+            'xml': f'<feed xmlns="{ARXIV_NS["atom"]}">{ET.tostring(elem, encoding="unicode")}</feed>'
+        }
+        elem.clear()
+
 def parse_arxiv_xml(xml_data,MODE: bool):
-    root = ET.fromstring(xml_data)
-
-    # arXiv 使用了命名空间，需要声明
-    ns = {'atom': 'http://www.w3.org/2005/Atom', 'arxiv': 'http://arxiv.org/schemas/atom'}
-
-    entry = root.find('atom:entry', ns)
-
-    # 提取字段
-    title = entry.find('atom:title', ns).text.strip()
-    summary = entry.find('atom:summary', ns).text.strip()
-    published = entry.find('atom:published', ns).text
-    authors = [author.find('atom:name', ns).text for author in entry.findall('atom:author', ns)]
-    pdf_link = None
-    for link in entry.findall('atom:link', ns):
-        if link.attrib.get('title') == 'pdf':
-            pdf_link = link.attrib['href']
-    if MODE:
-        response = requests.get(pdf_link)
-        pdf_file = io.BytesIO(response.content)
+    """解析feed中的第一篇论文，MODE为True时下载PDF全文，否则返回摘要"""
+    entry = next(parse_arxiv_entries(xml_data), None)
+    if entry is None:
+        return None
+    summary = entry['summary']
+    if MODE and entry['pdf_link']:
+        try:
+            response, body = stream_download(entry['pdf_link'], accept=('pdf',), max_bytes=MAX_PDF_BYTES, truncate=False)
+            response.raise_for_status()
+        except (UnsupportedContent, requests.exceptions.RequestException) as e:
+            print(f"PDF下载失败，使用摘要代替: {str(e)}")
+            return summary
+        from pypdf import PdfReader
+        pdf_file = io.BytesIO(body)
         reader = PdfReader(pdf_file)
         text = ""
         for page in reader.pages:
@@ -41,33 +228,79 @@ def parse_arxiv_xml(xml_data,MODE: bool):
         # print(summary)
         return summary
 
+@tracing.traced("fetch_arxiv_batch")
+def fetch_arxiv_batch(urls):
+    """通过一次id_list查询批量获取arXiv论文元数据，返回 {url: 单篇论文的feed}"""
+    feeds = {}
+    missing = {}
+    for url in urls:
+        cached = page_cache.get_page(url)
+        if cached and cached['fresh']:
+            feeds[url] = cached['html']
+            continue
+        paper_id = arxiv_id(url)
+        if paper_id:
+            missing.setdefault(paper_id, []).append(url)
+    if not missing:
+        return feeds
+
+    ids = ','.join(missing)
+    api_url = f"https://export.arxiv.org/api/query?id_list={ids}&max_results={len(missing)}"
+    response, body = stream_download(api_url)
+    response.raise_for_status()
+    for entry in parse_arxiv_entries(body):
+        for url in missing.get(entry['id'], []):
+            page_cache.put_page(url, entry['xml'])
+            feeds[url] = entry['xml']
+    return feeds
+
+@tracing.traced("fetch_webpage", "url")
 def fetch_webpage(url):
-    """改进的网页获取函数，支持自动重试"""
-    if "arxiv.org" in url:
-        # 使用arxiv官方API获取结构化数据
-        api_url = f"http://export.arxiv.org/api/query?id_list={url.split('/')[-1]}"
-        response = requests.get(api_url)
-        return response.text
+    """改进的网页获取函数，支持自动重试，优先使用本地缓存"""
+    cached = page_cache.get_page(url)
+    if cached and cached['fresh']:
+        tracing.annotate(cache="hit")
+        return cached['html']
     try:
-        response = requests.get(url, headers=HEADERS, timeout=15)
+        if "arxiv.org" in url:
+            # 使用arxiv官方API获取结构化数据
+            return fetch_arxiv_batch([url]).get(url)
+        response, body = stream_download(url, headers=page_cache.conditional_headers(cached))
+        tracing.annotate(status=response.status_code, bytes=len(body or b''))
+        if response.status_code == 304 and cached:
+            page_cache.touch_page(url)
+            return cached['html']
         response.raise_for_status()
+        html = decode_body(body, response)
         # 检查是否是验证页面（如知乎的反爬机制）
-        if "安全检查" in response.text:
+        if "安全检查" in html:
             print(f"触发验证页面: {url}")
             return None
-        return response.text
+        page_cache.put_page(url, html,
+                            response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return html
     except requests.exceptions.HTTPError as e:
         print(f"HTTP错误 {e.response.status_code} at {url}")
+    except UnsupportedContent as e:
+        print(f"跳过 {url}: {str(e)}")
     except Exception as e:
         print(f"获取页面失败: {str(e)}")
     return None
 
+@tracing.traced("extract_content", "url")
 def extract_content(html, url):
-    """使用newspaper3k提取正文内容"""
+    """使用newspaper3k从已下载的html中提取正文内容，不再重复下载，结果写入缓存"""
+    text = page_cache.get_text(url)
+    if text is not None:
+        tracing.annotate(cache="hit")
+        return text
     try:
+        from newspaper import Article
         article = Article(url)
-        article.download()
+        article.download(input_html=html)
         article.parse()
+        if article.text:
+            page_cache.put_text(url, article.text)
         return article.text
     except Exception as e:
         print(f"Error parsing {url}: {str(e)}")
@@ -95,44 +328,207 @@ def parse_custom_format(raw_str):
             continue
     return results
 
-def search_results(query):
-    """执行搜索并爬取结果页面"""
-    search = DuckDuckGoSearchResults(output_format='list')
-    results = search.invoke(query)
+def _host_semaphore(url):
+    """获取站点对应的信号量，限制同一站点的并发请求数"""
+    host = urlparse(url).netloc.lower()
+    with _host_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(PER_HOST_LIMIT)
+        return _host_semaphores[host]
 
-    references = []
+def process_result(result):
+    """抓取并提取单条搜索结果，失败时返回None"""
+    try:
+        with _host_semaphore(result['link']):
+            html = fetch_webpage(result['link'])
+            if not html:
+                return None
+            if 'arxiv.org' in result['link']:
+                content = parse_arxiv_xml(html, False)
+            else:
+                content = extract_content(html, result['link'])
+    except Exception as e:
+        print(f"处理结果失败 {result['link']}: {str(e)}")
+        return None
+    if not content:
+        return None
+    return {
+        'title': result['title'],
+        'link': result['link'],
+        'content': content
+    }
+
+def process_arxiv_results(results):
+    """批量处理arXiv搜索结果，返回 {link: reference}"""
+    try:
+        feeds = fetch_arxiv_batch([result['link'] for result in results])
+    except Exception as e:
+        print(f"arXiv批量查询失败: {str(e)}")
+        return {}
+    references = {}
+    for result in results:
+        feed = feeds.get(result['link'])
+        content = parse_arxiv_xml(feed, False) if feed else None
+        if content:
+            references[result['link']] = {
+                'title': result['title'],
+                'link': result['link'],
+                'content': content
+            }
+    return references
+
+def _collect(partial, rank, future):
+    """页面抓取完成的回调：立即把结果按排名写入 partial"""
+    if not future.cancelled() and future.exception() is None and future.result():
+        partial[rank] = future.result()
+
+def _collect_arxiv(partial, ranks, future):
+    if not future.cancelled() and future.exception() is None:
+        for link, reference in future.result().items():
+            partial[ranks[link]] = reference
+
+@tracing.traced("search_results", "query")
+def search_results(query, deadline=SEARCH_DEADLINE, end=None, partial=None):
+    """执行搜索并并发爬取结果页面，按搜索排名返回在时限内完成的结果
+
+    end 为 time.monotonic() 的绝对截止时间，同时约束搜索引擎调用和页面抓取，未指定时为 deadline 秒后。
+    partial 为字典时，每个页面完成后立即写入 {排名: 参考资料}，调用者等不及整个搜索结束时可以直接使用。
+    """
+    end = end if end is not None else time.monotonic() + deadline
+    remaining = lambda: max(0.0, end - time.monotonic())
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    # 搜索引擎调用同样计入时限
+    search_future = executor.submit(lambda: get_search_tool().invoke(query))
+    try:
+        results = search_future.result(timeout=remaining())
+    except FuturesTimeout:
+        executor.shutdown(wait=False, cancel_futures=True)
+        print(f"搜索「{query}」超过时限，已放弃")
+        return []
+    except Exception:
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
 
+    pending = []
     for i, result in enumerate(results, 1):
+        if result['title'] == 'EOF':
+            break
         print(f"\n{'='*50}\nProcessing result {i}/{len(results)}")
         print(f"Title: {result['title']}")
         print(f"URL: {result['link']}")
-        if result['title'] == 'EOF':
-            return references
+        pending.append(result)
 
-        html = fetch_webpage(result['link'])
-        if html:
-            if 'arxiv.org' in result['link']:
-                references.append({
-                    'title': result['title'],
-                    'link': result['link'],
-                    'content': parse_arxiv_xml(html,False)
-                })
-                continue
-            content = extract_content(html, result['link'])
-            if content:
-                # print(f"\nExtracted content ({len(content)} characters):")
-                # print(content[:500] + "...")  # 显示前500个字符
-                references.append({
-                    'title': result['title'],
-                    'link': result['link'],
-                    'content': content
-                })
-            # else:
-                # print("Failed to extract content")
-        # else:
-            # print("Failed to fetch webpage")
+    if not pending:
+        executor.shutdown(wait=False)
+        return []
+
+    # arXiv论文合并为一次批量查询，其余页面各自抓取
+    arxiv_results = [result for result in pending if arxiv_id(result['link'])]
+    ranks = {result['link']: rank for rank, result in enumerate(pending)}
+    futures = {}
+    for result in pending:
+        if result not in arxiv_results:
+            future = executor.submit(tracing.bind(process_result), result)
+            if partial is not None:
+                future.add_done_callback(lambda f, rank=ranks[result['link']]: _collect(partial, rank, f))
+            futures[result['link']] = future
+    arxiv_future = executor.submit(tracing.bind(process_arxiv_results), arxiv_results) if arxiv_results else None
+    if arxiv_future and partial is not None:
+        arxiv_future.add_done_callback(lambda f: _collect_arxiv(partial, ranks, f))
+    all_futures = list(futures.values()) + ([arxiv_future] if arxiv_future else [])
+    done, not_done = wait(all_futures, timeout=remaining())
+    # 不等待超时的页面，直接丢弃
+    executor.shutdown(wait=False, cancel_futures=True)
+    if not_done:
+        print(f"{len(not_done)} 个任务超过时限，已丢弃")
+
+    arxiv_references = arxiv_future.result() if arxiv_future in done else {}
+    references = []
+    for result in pending:
+        if result in arxiv_results:
+            reference = arxiv_references.get(result['link'])
+        else:
+            future = futures[result['link']]
+            reference = future.result() if future in done else None
+        if reference:
+            references.append(reference)
     return references
 
+def split_keywords(keywords):
+    """拆分模型生成的逗号分隔关键词"""
+    parts = re.split(r'[,，、;；\n]+', keywords)
+    return [part.strip() for part in parts if part.strip()][:MAX_KEYWORDS]
+
+def merge_references(groups):
+    """按各组排名轮流合并参考资料，并按链接去重"""
+    merged = []
+    seen = set()
+    for rank in range(max((len(group) for group in groups), default=0)):
+        for group in groups:
+            if rank < len(group):
+                key = page_cache.normalize_url(group[rank]['link'])
+                if key not in seen:
+                    seen.add(key)
+                    merged.append(group[rank])
+    return merged[:MAX_REFERENCES]
+
+def orchestrate_search(prompt, generate_keywords, deadline=TURN_DEADLINE, progress=None):
+    """并发完成一轮搜索
+
+    原始提问的搜索与关键词生成同时进行；关键词生成后每个关键词并行搜索。
+    progress(message) 在调用者线程中被调用，用于展示进度；超过时限后返回已完成的结果，
+    未完成的搜索中已抓取完的页面同样保留。
+    """
+    progress = progress or print
+    end = time.monotonic() + deadline
+    remaining = lambda: max(0.0, end - time.monotonic())
+    executor = ThreadPoolExecutor(max_workers=MAX_KEYWORDS + 2)
+    raw_partial = {}
+    raw_future = executor.submit(tracing.bind(search_results), prompt, deadline, end, raw_partial)
+    keyword_future = executor.submit(tracing.bind(generate_keywords), prompt)
+    searches = {raw_future: prompt}
+    partials = {raw_future: raw_partial}
+    pending = {raw_future, keyword_future}
+    progress("正在搜索原始问题并生成搜索关键词...")
+
+    while pending and remaining() > 0:
+        done, pending = wait(pending, timeout=remaining(), return_when=FIRST_COMPLETED)
+        for future in done:
+            if future is keyword_future:
+                try:
+                    keywords = split_keywords(future.result())
+                except Exception as e:
+                    progress(f"关键词生成失败: {str(e)}")
+                    continue
+                progress(f"搜索关键词：{'、'.join(keywords)}")
+                for keyword in keywords:
+                    partial = {}
+                    search_future = executor.submit(tracing.bind(search_results), keyword, deadline, end, partial)
+                    searches[search_future] = keyword
+                    partials[search_future] = partial
+                    pending.add(search_future)
+            else:
+                try:
+                    progress(f"「{searches[future]}」完成，获得 {len(future.result())} 条资料")
+                except Exception as e:
+                    progress(f"「{searches[future]}」搜索失败: {str(e)}")
+    executor.shutdown(wait=False, cancel_futures=True)
+    if pending:
+        progress(f"已到达时限 {deadline}s，{len(pending)} 个任务未完成，使用已获得的资料")
+
+    def collected(future):
+        # 完成的搜索取完整结果，未完成的取已抓取完的页面
+        if future.done() and not future.exception():
+            return future.result()
+        partial = dict(partials[future])
+        return [partial[rank] for rank in sorted(partial)]
+
+    # 各组按名次轮流合并，同一名次中关键词搜索的结果在前
+    groups = [collected(future) for future in searches if future is not raw_future]
+    groups.append(collected(raw_future))
+    # 去重并只保留与提问最相关的段落
+    return rerank.rank_references(prompt, merge_references(groups))
+
 if __name__ == "__main__":
     query = "自我原则点评调优（SPCT）与元奖励模型（Meta Reward Model）"
     all_references = search_results(query)  # Store the returned list
@@ -0,0 +1,101 @@
+"""流式回答的增量渲染
+
+逐块到达的增量先合并，再按时间/长度预算刷新；LaTeX 分隔符只在新到达的尾部转换。
+已完成的 markdown 段落（空行分隔，且不在代码块或公式块内）会固定到各自的占位符中，
+之后每次刷新只重绘最后一个未完成的段落。
+"""
+import re
+import time
+
+RENDER_INTERVAL = 0.075   # 两次刷新的最小间隔（秒）
+RENDER_MAX_PENDING = 2048 # 累积的未渲染字符超过该值时立即刷新
+CURSOR = "▌"
+
+FENCE = re.compile(r'^\s*(```|~~~)')
+TRAILING_BACKSLASHES = re.compile(r'\\+$')
+
+
+def convert_latex(text: str):
+    """将 \\( \\) \\[ \\] 形式的公式转换为 streamlit 支持的 $ / $$"""
+    text = text.replace(r'\\\\', r"\\")
+    text = text.replace(r'\(', r"$")
+    text = text.replace(r'\)', r"$")
+    text = text.replace(r'\[', r"$$")
+    text = text.replace(r'\]', r"$$")
+    return text
+
+
+def split_blocks(text):
+    """把文本拆成已完成的段落和仍在增长的尾部，返回 (blocks, tail)"""
+    blocks = []
+    start = 0
+    pos = 0
+    in_fence = False
+    in_math = False
+    for line in text.splitlines(keepends=True):
+        end = pos + len(line)
+        if FENCE.match(line):
+            in_fence = not in_fence
+        elif not in_fence and line.count('$$') % 2:
+            in_math = not in_math
+        # 只有以换行结束的空行才算段落边界
+        if not line.strip() and line.endswith('\n') and not in_fence and not in_math and text[start:pos].strip():
+            blocks.append(text[start:pos])
+            start = end
+        pos = end
+    return blocks, text[start:]
+
+
+class StreamRenderer:
+    """把增量文本渲染到给定容器中"""
+
+    def __init__(self, container, interval=RENDER_INTERVAL, max_pending=RENDER_MAX_PENDING):
+        self.container = container
+        self.interval = interval
+        self.max_pending = max_pending
+        self.text = ""          # 收到的全部原始文本
+        self.pending = ""       # 尚未转换的原始文本
+        self.tail = ""          # 已转换、尚未固定的尾部段落
+        self.last_render = 0.0
+        self.tail_placeholder = None
+
+    def feed(self, delta):
+        if not delta:
+            return
+        self.text += delta
+        self.pending += delta
+        if len(self.pending) >= self.max_pending or time.monotonic() - self.last_render >= self.interval:
+            self.flush()
+
+    def flush(self, final=False):
+        pending = self.pending
+        if not final:
+            # 末尾的反斜杠可能属于下一块中的分隔符，暂不转换
+            match = TRAILING_BACKSLASHES.search(pending)
+            carry = match.group(0) if match else ""
+            pending = pending[:len(pending) - len(carry)]
+        else:
+            carry = ""
+        self.pending = carry
+        self.tail += convert_latex(pending)
+
+        blocks, self.tail = split_blocks(self.tail)
+        for block in blocks:
+            # 已完成的段落写入当前占位符后不再重绘
+            self._placeholder().markdown(block)
+            self.tail_placeholder = None
+        if self.tail.strip() or not final:
+            self._placeholder().markdown(self.tail + ("" if final else CURSOR))
+        elif self.tail_placeholder is not None:
+            # 结束时尾部为空，清掉仍显示光标的占位符
+            self.tail_placeholder.empty()
+        self.last_render = time.monotonic()
+
+    def finish(self):
+        self.flush(final=True)
+        return self.text
+
+    def _placeholder(self):
+        if self.tail_placeholder is None:
+            self.tail_placeholder = self.container.empty()
+        return self.tail_placeholder
@@ -0,0 +1,59 @@
+"""后台生成对话标题
+
+对话先以临时名称保存，标题在后台线程中生成后写入对话目录；相同的首条提问直接复用缓存的标题。
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import convo_store
+import tracing
+
+TITLE_CACHE_SIZE = 256
+TITLE_WORKERS = 2
+
+_executor = ThreadPoolExecutor(max_workers=TITLE_WORKERS, thread_name_prefix="title")
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _key(text):
+    return hashlib.sha256(text.strip().encode("utf-8")).hexdigest()
+
+
+def cached_title(text):
+    with _lock:
+        title = _cache.get(_key(text))
+        if title is not None:
+            _cache.move_to_end(_key(text))
+        return title
+
+
+def _remember(text, title):
+    with _lock:
+        _cache[_key(text)] = title
+        _cache.move_to_end(_key(text))
+        while len(_cache) > TITLE_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _run(name, text, generate):
+    try:
+        title = generate(text)
+    except Exception as e:
+        print(f"生成对话标题失败: {str(e)}")
+        return None
+    if title:
+        _remember(text, title)
+        convo_store.set_title(name, title)
+    return title
+
+
+def submit(name, text, generate):
+    """为对话生成标题：命中缓存时立即写入，否则提交到后台线程"""
+    title = cached_title(text)
+    if title:
+        convo_store.set_title(name, title)
+        return None
+    return _executor.submit(tracing.bind(_run), name, text, generate)
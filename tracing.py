@@ -0,0 +1,237 @@
+"""每轮对话的耗时追踪与指标
+
+span() 记录一段操作的起止时间和属性：
+- 写入滚动的 JSONL 日志（Logs/trace.jsonl）
+- 汇总为各操作的耗时直方图，可通过 Prometheus 文本格式的 HTTP 端点导出
+- 挂到当前轮次上，供侧边栏显示上一轮的瀑布图
+
+线程池中的任务需用 bind() 包装，才能归属到提交它的轮次和父 span。
+"""
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+
+LOG_DIR = "Logs"
+TRACE_FILE = os.path.join(LOG_DIR, "trace.jsonl")
+TRACE_MAX_BYTES = 5 * 1024 * 1024
+TRACE_BACKUPS = 3
+METRIC_PREFIX = "deepseek_gui"
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+WATERFALL_WIDTH = 30
+
+_turn = contextvars.ContextVar("trace_turn", default=None)
+_span = contextvars.ContextVar("trace_span", default=None)
+_lock = threading.Lock()
+_logger = None
+_histograms = {}    # span名 -> {"buckets", "sum", "count", "errors"}
+_summaries = {}     # 指标名 -> {"sum", "count"}
+_server = None
+
+
+def _get_logger():
+    global _logger
+    with _lock:
+        if _logger is None:
+            os.makedirs(LOG_DIR, exist_ok=True)
+            handler = RotatingFileHandler(TRACE_FILE, maxBytes=TRACE_MAX_BYTES,
+                                          backupCount=TRACE_BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger("deepseek_gui.trace")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            _logger = logger
+        return _logger
+
+
+def _write(record):
+    try:
+        _get_logger().info(json.dumps(record, ensure_ascii=False, default=str))
+    except Exception as e:
+        print(f"写入追踪日志失败: {str(e)}")
+
+
+def _observe_span(name, seconds, error):
+    with _lock:
+        histogram = _histograms.setdefault(
+            name, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0, "errors": 0})
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+        if error:
+            histogram["errors"] += 1
+
+
+def record(metric, value):
+    """记录一个数值指标（如首token延迟、输出速率），导出为 summary"""
+    if value is None:
+        return
+    with _lock:
+        summary = _summaries.setdefault(metric, {"sum": 0.0, "count": 0})
+        summary["sum"] += value
+        summary["count"] += 1
+
+
+def start_turn(**attrs):
+    """开始一轮对话的追踪，之后在本线程（及 bind 的任务）中创建的 span 都归属于这一轮"""
+    turn = {
+        "id": uuid.uuid4().hex[:12],
+        "started_at": time.time(),
+        "start": time.perf_counter(),
+        "duration": None,
+        "attrs": attrs,
+        "spans": [],
+    }
+    _turn.set(turn)
+    return turn
+
+
+def finish_turn(turn):
+    turn["duration"] = time.perf_counter() - turn["start"]
+    _turn.set(None)
+    _observe_span("turn", turn["duration"], False)
+    _write({"type": "turn", "turn": turn["id"], "started_at": turn["started_at"],
+            "duration": round(turn["duration"], 4), "attrs": turn["attrs"],
+            "spans": len(turn["spans"])})
+    print(f"本轮耗时 {turn['duration']:.2f}s（{len(turn['spans'])} 个span，详见 {TRACE_FILE}）")
+    return turn
+
+
+@contextmanager
+def span(name, **attrs):
+    """记录一段操作；yield 出的字典可以继续添加属性"""
+    turn = _turn.get()
+    parent = _span.get()
+    current = {"name": name, "attrs": attrs, "depth": parent["depth"] + 1 if parent else 0}
+    token = _span.set(current)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _span.reset(token)
+        _observe_span(name, duration, error)
+        entry = {
+            "type": "span",
+            "turn": turn["id"] if turn else None,
+            "name": name,
+            "parent": parent["name"] if parent else None,
+            "depth": current["depth"],
+            "offset": round(start - turn["start"], 4) if turn else None,
+            "duration": round(duration, 4),
+            "thread": threading.current_thread().name,
+            "error": error,
+            "attrs": attrs,
+        }
+        if turn:
+            turn["spans"].append(entry)
+        _write(entry)
+
+
+def annotate(**attrs):
+    """给当前 span 添加属性（如缓存是否命中）"""
+    current = _span.get()
+    if current:
+        current["attrs"].update(attrs)
+
+
+def traced(name, *params):
+    """装饰器：把每次调用记为一个 span，params 中列出的参数作为属性记录"""
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            with span(name, **{param: arguments.get(param) for param in params}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(func):
+    """把当前轮次和父 span 绑定到要提交给线程池的函数上（每次提交调用一次）"""
+    context = contextvars.copy_context()
+    return functools.partial(context.run, func)
+
+
+def waterfall(turn, width=WATERFALL_WIDTH):
+    """把一轮的 span 按开始时间排成文本瀑布图"""
+    total = max(turn["duration"] or time.perf_counter() - turn["start"], 1e-6)
+    lines = []
+    for entry in sorted(turn["spans"], key=lambda e: e["offset"]):
+        begin = min(int(entry["offset"] / total * width), width - 1)
+        length = max(1, round(entry["duration"] / total * width))
+        bar = " " * begin + "█" * min(length, width - begin)
+        label = "  " * entry["depth"] + entry["name"]
+        lines.append(f"{label[:26]:<26} |{bar:<{width}}| {entry['duration'] * 1000:>7.0f}ms"
+                     + (f" ✗{entry['error']}" if entry["error"] else ""))
+    lines.append(f"{'总计':<25}  {'':<{width}}  {total * 1000:>7.0f}ms")
+    return "\n".join(lines)
+
+
+def render_metrics():
+    """以 Prometheus 文本格式导出所有指标"""
+    lines = [f"# TYPE {METRIC_PREFIX}_span_seconds histogram"]
+    with _lock:
+        for name, histogram in sorted(_histograms.items()):
+            for bound, count in zip(BUCKETS, histogram["buckets"]):
+                lines.append(f'{METRIC_PREFIX}_span_seconds_bucket{{span="{name}",le="{bound}"}} {count}')
+            lines.append(f'{METRIC_PREFIX}_span_seconds_bucket{{span="{name}",le="+Inf"}} {histogram["count"]}')
+            lines.append(f'{METRIC_PREFIX}_span_seconds_sum{{span="{name}"}} {histogram["sum"]:.6f}')
+            lines.append(f'{METRIC_PREFIX}_span_seconds_count{{span="{name}"}} {histogram["count"]}')
+        lines.append(f"# TYPE {METRIC_PREFIX}_span_errors_total counter")
+        for name, histogram in sorted(_histograms.items()):
+            lines.append(f'{METRIC_PREFIX}_span_errors_total{{span="{name}"}} {histogram["errors"]}')
+        for metric, summary in sorted(_summaries.items()):
+            lines.append(f"# TYPE {METRIC_PREFIX}_{metric} summary")
+            lines.append(f"{METRIC_PREFIX}_{metric}_sum {summary['sum']:.6f}")
+            lines.append(f"{METRIC_PREFIX}_{metric}_count {summary['count']}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """在后台线程启动 /metrics 端点（进程内只启动一次）"""
+    global _server
+    with _lock:
+        if _server is not None:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            print(f"指标端点启动失败 {host}:{port}: {str(e)}")
+            return None
+    threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    print(f"指标端点: http://{host}:{port}/metrics")
+    return _server